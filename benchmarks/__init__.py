@@ -0,0 +1,6 @@
+"""
+Бенчмарки компилятора и рантайма шаблонизатора Suit
+
+Запуск: python -m benchmarks [--quick] [--output results.json]
+
+"""
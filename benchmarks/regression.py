@@ -0,0 +1,228 @@
+"""
+Проверка производительности на регрессии относительно сохраненного базового уровня
+
+python -m benchmarks.regression [--threshold 0.2] [--memory-threshold 0.1]   - сравнение с базовым уровнем
+python -m benchmarks.regression --update [--rounds 3]                       - обновление базового уровня
+
+Для каждого сценария измеряется время выполнения (минимум по нескольким сериям) относительно эталонной нагрузки,
+измеренной тут же, - так сравнение не зависит от скорости и загрузки машины (секунды сохраняются для справки),
+и память (tracemalloc): пиковая память вызова и количество блоков, оставшихся выделенными после освобождения
+результата. Отклонения сверх порога шума выводятся в таблице и завершают проверку с ошибкой
+
+"""
+import gc
+import os
+import sys
+import json
+import timeit
+import platform
+import tracemalloc
+from html import escape as html_escape
+from argparse import ArgumentParser
+from datetime import datetime
+
+import suit
+from suit.Suit import Suit, TemplatePart
+from benchmarks.scenarios import Case, Workspace, wide_table, include_in_loop, filters, escaping
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# проверяемая метрика: (порог по умолчанию, допустимое абсолютное отклонение)
+METRICS = {"relative_time": (0.2, 0.0), "peak_memory": (0.1, 1024), "retained_blocks": (0.1, 32)}
+
+
+def reference():
+    """ Эталонная нагрузка: форматирование и экранирование строк таблицы средствами самого python """
+    rows = [{"id": i, "name": "row <%d>" % i} for i in range(200)]
+    return "".join(["<tr><td>%s</td><td>%s</td></tr>" % (row["id"], html_escape(row["name"])) for row in rows])
+
+
+def scenarios(workspace):
+    """
+    Возвращает измеряемые сценарии {имя: функция без аргументов}
+
+    :param workspace:   Workspace, в котором компилируются шаблоны сценариев
+    """
+    def render(case):
+        template = workspace.write(case)
+        return lambda: Suit(template).execute(case.data)
+
+    table = Case("gate_table", 200, *wide_table(200))
+    escape = Case("gate_escaping", 200, *escaping(200))
+    include = Case("gate_include", 200, *include_in_loop(200))
+    # параметры с условием не компилируются в словарь заранее и разбираются в SuitRunTime.include
+    runtime = Case("gate_include_runtime", 50, dict(include.files, list=include.files["list"].replace(
+        '<var>row</var>}', '<var>row</var>, "odd": [<if condition="<var>row.active</var>">1</if>]}'
+    )), include.template, {"rows": include.data["rows"][:50]})
+    source = "".join(filters(200)[0].values()) + "".join(wide_table(200)[0].values())
+
+    result = {
+        "execute": render(table), "escaping": render(escape), "include_scope": render(include), "include": render(runtime)
+    }
+    workspace.compile()
+    result["parse"] = lambda: TemplatePart(source).getTree()
+    result["build"] = workspace.build
+    return result
+
+
+def measure(function, repeat=5):
+    """
+    Измеряет функцию
+
+    :param function:    Функция без аргументов
+    :param repeat:      Количество серий измерения времени
+    :return: dict:      time - секунды на вызов, relative_time - время вызова в долях времени эталонной нагрузки,
+                        peak_memory - байты, retained_blocks - блоки
+    """
+    def blocks(snapshot, reference):
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        stats = snapshot.filter_traces(ignore).compare_to(reference.filter_traces(ignore), "filename")
+        return max(sum(stat.count_diff for stat in stats), 0)
+
+    function()  # прогрев: импорт шаблонов и кеши рантайма
+    # серии сценария и эталонной нагрузки чередуются, чтобы оба минимума пришлись на одни и те же условия машины
+    timers = [timeit.Timer(function), timeit.Timer(reference)]
+    numbers = [timer.autorange()[0] for timer in timers]
+    elapsed, base = (min(values) for values in zip(*[
+        [timer.timeit(number) / number for timer, number in zip(timers, numbers)] for _ in range(repeat * 2)
+    ]))
+    relative = elapsed / base
+
+    # циклический мусор (например, сканеры json) собирается перед снимками, а из нескольких замеров берется
+    # минимум, иначе счетчики блоков зависят от того, когда сработал сборщик мусора
+    memory = []
+    tracemalloc.start()
+    try:
+        for _ in range(repeat):
+            gc.collect()
+            before = tracemalloc.take_snapshot()
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            result = function()
+            peak = tracemalloc.get_traced_memory()[1] - current
+            del result
+            gc.collect()
+            after = tracemalloc.take_snapshot()
+            memory.append((peak, blocks(after, before)))
+    finally:
+        tracemalloc.stop()
+    peak, retained = (min(values) for values in zip(*memory))
+    return {"time": elapsed, "relative_time": relative, "peak_memory": peak, "retained_blocks": retained}
+
+
+def collect(names=None, rounds=1):
+    """
+    Измеряет все сценарии (или только перечисленные)
+
+    :param names:   Имена сценариев
+    :param rounds:  Количество измерений каждого сценария, сохраняется медиана каждой метрики
+                    (базовый уровень не должен опираться на случайно удачный замер)
+    """
+    results = {}
+    with Workspace() as workspace:
+        for name, function in sorted(scenarios(workspace).items()):
+            if not names or name in names:
+                measured = [measure(function) for _ in range(rounds)]
+                results[name] = {metric: sorted(m[metric] for m in measured)[rounds // 2] for metric in measured[0]}
+    return results
+
+
+def compare(baseline, current, thresholds):
+    """
+    Сравнивает измерения с базовым уровнем
+
+    :param baseline:    Базовые измерения {сценарий: {метрика: значение}}
+    :param current:     Текущие измерения
+    :param thresholds:  Пороги шума {метрика: доля}
+    :return: list:      Строки сравнения (сценарий, метрика, базовое значение, текущее, изменение, статус)
+                        Метрики без порога (секунды) выводятся для справки
+    """
+    rows = []
+    for name in sorted(current):
+        for metric in sorted(current[name]):
+            value = current[name][metric]
+            base = baseline.get(name, {}).get(metric)
+            if base is None:
+                rows.append((name, metric, None, value, None, "new"))
+                continue
+            change = (value - base) / base if base else (0.0 if value == base else float("inf"))
+            if metric not in METRICS:
+                rows.append((name, metric, base, value, change, "info"))
+                continue
+            limit = base * (1 + thresholds[metric]) + METRICS[metric][1]
+            if value > limit:
+                status = "REGRESSION"
+            elif value < base * (1 - thresholds[metric]) - METRICS[metric][1]:
+                status = "improved"
+            else:
+                status = "ok"
+            rows.append((name, metric, base, value, change, status))
+    return rows
+
+
+def table(rows):
+    """ Возвращает таблицу сравнения в текстовом виде """
+    def number(metric, value):
+        if value is None:
+            return "-"
+        if metric == "time":
+            return "%.3f ms" % (value * 1000)
+        return "%.2f" % value if metric == "relative_time" else "%d" % value
+
+    lines = ["%-16s %-16s %14s %14s %9s  %s" % ("scenario", "metric", "baseline", "current", "change", "status")]
+    for name, metric, base, value, change, status in rows:
+        lines.append("%-16s %-16s %14s %14s %9s  %s" % (
+            name, metric, number(metric, base), number(metric, value),
+            "-" if change is None else "%+.1f%%" % (change * 100), status
+        ))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = ArgumentParser(description="Suit performance regression gate")
+    parser.add_argument("--baseline", default=BASELINE, help="path of the baseline file")
+    parser.add_argument("--update", action="store_true", help="measure and store a new baseline")
+    parser.add_argument("--scenario", action="append", help="scenario to check (repeatable)")
+    parser.add_argument("--rounds", type=int, default=None,
+                        help="measurements of each scenario, the median is taken (default: 3 with --update, else 1)")
+    parser.add_argument("--threshold", type=float, default=METRICS["relative_time"][0],
+                        help="allowed relative slowdown (noise threshold) of time relative to the reference workload")
+    parser.add_argument("--memory-threshold", type=float, default=METRICS["peak_memory"][0],
+                        help="allowed relative growth of allocations")
+    args = parser.parse_args(argv)
+
+    current = collect(args.scenario, args.rounds or (3 if args.update else 1))
+    if args.update:
+        if args.scenario and os.path.isfile(args.baseline):
+            # обновляются только перечисленные сценарии, остальные сохраняются
+            with open(args.baseline) as f:
+                current = dict(json.load(f)["scenarios"], **current)
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "meta": {
+                    "suit": suit.__version__, "python": platform.python_version(),
+                    "platform": platform.platform(), "date": datetime.now().isoformat()
+                },
+                "scenarios": current
+            }, f, indent=1, sort_keys=True)
+        print(table(compare({}, current, {})))
+        print("baseline updated: %s" % args.baseline)
+        return 0
+
+    if not os.path.isfile(args.baseline):
+        print("baseline not found: %s (create it with --update)" % args.baseline, file=sys.stderr)
+        return 2
+    with open(args.baseline) as f:
+        baseline = json.load(f)["scenarios"]
+    thresholds = dict({metric: args.memory_threshold for metric in METRICS}, relative_time=args.threshold)
+    rows = compare(baseline, current, thresholds)
+    print(table(rows))
+    regressions = [row for row in rows if row[5] == "REGRESSION"]
+    if regressions:
+        print("%d regression(s) beyond the noise threshold" % len(regressions), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
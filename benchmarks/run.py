@@ -0,0 +1,139 @@
+"""
+Запуск бенчмарков: время компиляции, задержка выполнения (перцентили), пропускная способность и пиковая память
+
+python -m benchmarks [--quick] [--scenario name ...] [--output results.json]
+
+"""
+import sys
+import json
+import time
+import platform
+import tracemalloc
+from argparse import ArgumentParser
+from datetime import datetime
+
+import suit
+from suit.Suit import Suit
+from benchmarks.scenarios import cases, Workspace, SCENARIOS
+
+
+def percentile(values, p):
+    """
+    Возвращает перцентиль отсортированного списка значений
+
+    :param values:  Отсортированный список
+    :param p:       Перцентиль (0-100)
+    """
+    index = (len(values) - 1) * p / 100.0
+    lower = int(index)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (index - lower)
+
+
+def measure_render(template, data, budget=1.0, min_runs=5, max_runs=1000):
+    """
+    Многократно выполняет шаблон и возвращает статистику задержек
+
+    :param template:    Имя шаблона
+    :param data:        Данные для выполнения
+    :param budget:      Время (в секундах), отводимое на измерения
+    :param min_runs:    Минимальное количество выполнений
+    :param max_runs:    Максимальное количество выполнений
+    """
+    output = Suit(template).execute(data)  # прогрев: импорт шаблона и кеши рантайма
+    latencies = []
+    started = time.perf_counter()
+    while len(latencies) < max_runs and (len(latencies) < min_runs or time.perf_counter() - started < budget):
+        start = time.perf_counter()
+        Suit(template).execute(data)
+        latencies.append(time.perf_counter() - start)
+    total = sum(latencies)
+    latencies.sort()
+    return {
+        "runs": len(latencies),
+        "mean": total / len(latencies),
+        "min": latencies[0],
+        "p50": percentile(latencies, 50),
+        "p90": percentile(latencies, 90),
+        "p99": percentile(latencies, 99),
+        "max": latencies[-1],
+        "throughput": len(latencies) / total if total else None,
+        "output_bytes": len(output.encode()),
+    }
+
+
+def measure_memory(template, data):
+    """ Возвращает пиковый объем памяти (в байтах), выделяемой при выполнении шаблона """
+    tracemalloc.start()
+    try:
+        Suit(template).execute(data)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(names=None, quick=False, budget=1.0, log=sys.stderr):
+    """
+    Выполняет бенчмарки и возвращает результаты
+
+    :param names:   Имена сценариев (по умолчанию - все)
+    :param quick:   Только маленькие размеры
+    :param budget:  Время (в секундах) на измерение выполнения каждого сценария
+    :param log:     Поток для вывода прогресса
+    """
+    results = []
+    with Workspace() as workspace:
+        for case in cases(names, quick):
+            template = workspace.write(case)
+            start = time.perf_counter()
+            compiler = workspace.compile()
+            compile_time = time.perf_counter() - start
+            start = time.perf_counter()
+            workspace.build()
+            build_time = time.perf_counter() - start
+            result = {
+                "scenario": case.scenario,
+                "size": case.size,
+                "templates": compiler.compiled,
+                "compile_time": compile_time,
+                "build_time": build_time,
+                "render": measure_render(template, case.data, budget),
+                "peak_memory": measure_memory(template, case.data),
+            }
+            results.append(result)
+            print("%-16s %6s  compile %8.2f ms  p50 %9.3f ms  p99 %9.3f ms  %8.1f renders/s  peak %8.1f KiB" % (
+                case.scenario, case.size, compile_time * 1000, result["render"]["p50"] * 1000,
+                result["render"]["p99"] * 1000, result["render"]["throughput"], result["peak_memory"] / 1024.0
+            ), file=log)
+    return {
+        "meta": {
+            "suit": suit.__version__,
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "date": datetime.now().isoformat(),
+            "quick": quick,
+        },
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = ArgumentParser(description="Suit benchmarks")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="scenario to run (repeatable)")
+    parser.add_argument("--quick", action="store_true", help="run small sizes only")
+    parser.add_argument("--budget", type=float, default=1.0, help="seconds spent on rendering of each case")
+    parser.add_argument("--output", default="benchmarks/results.json", help="path of the json results ('-' - stdout)")
+    args = parser.parse_args(argv)
+
+    results = run(args.scenario, args.quick, args.budget)
+    if args.output == "-":
+        json.dump(results, sys.stdout, indent=1)
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+        print("results: %s" % args.output, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""
+Генераторы шаблонов и данных для бенчмарков
+
+Каждый сценарий по размеру (количеству строк, глубине вложенности и т.п.) строит набор исходников шаблонов,
+имя шаблона, который нужно выполнять, и данные для его выполнения
+
+"""
+import os
+import io
+import sys
+import shutil
+import tempfile
+import contextlib
+from collections import namedtuple
+from datetime import datetime
+
+from suit.Suit import Compiler, Suit
+
+
+class Case(namedtuple("Case", "scenario size files template data")):
+    """ Сценарий заданного размера: исходники шаблонов {имя: текст}, имя выполняемого шаблона и данные """
+    __slots__ = ()
+
+    @property
+    def folder(self):
+        return "%s_%s" % (self.scenario, self.size)
+
+
+def wide_table(size, columns=10):
+    """ Широкая таблица: size строк по columns ячеек """
+    cells = "".join("<td><var>row.c%d</var></td>" % i for i in range(columns))
+    template = '<table><list for="row" in="rows"><tr>%s</tr></list></table>' % cells
+    rows = [{"c%d" % i: "cell <%d:%d>" % (n, i) for i in range(columns)} for n in range(size)]
+    return {"table": template}, "table", {"rows": rows}
+
+
+def deep_lists(size, width=3):
+    """ Вложенные циклы глубины size по width элементов на каждом уровне """
+    template = '<var>l%d.name</var>;' % (size - 1)
+    for level in reversed(range(size)):
+        iterable = "items" if level == 0 else "l%d.children" % (level - 1)
+        template = '<list for="l%d" in="%s">[%s]</list>' % (level, iterable, template)
+
+    def tree(level):
+        return [
+            {"name": "node %d.%d" % (level, i), "children": tree(level + 1) if level + 1 < size else []}
+            for i in range(width)
+        ]
+
+    return {"tree": template}, "tree", {"items": tree(0)}
+
+
+def include_in_loop(size):
+    """ Включаемый шаблон внутри цикла из size строк """
+    row = '<li><var>row.name</var> (<var>row.id</var>)<if condition="<var>row.active</var>">*</if></li>'
+    template = '<ul><list for="row" in="rows"><breakpoint include="{folder}.row">{"row": <var>row</var>}</breakpoint></list></ul>'
+    rows = [{"id": n, "name": "item %d" % n, "active": n % 2 == 0} for n in range(size)]
+    return {"row": row, "list": template}, "list", {"rows": rows}
+
+
+def rebase_chain(size):
+    """ Цепочка наследования из size уровней, каждый уровень переопределяет свой блок """
+    base = "".join('<div><breakpoint name="b%d">base %d</breakpoint></div>' % (i, i) for i in range(size))
+    files = {"level0": base}
+    for level in range(1, size + 1):
+        files["level%d" % level] = '<rebase>{folder}.level%d</rebase><breakpoint name="b%d"><var>v%d</var></breakpoint>' % (
+            level - 1, level - 1, level - 1
+        )
+    return files, "level%d" % size, {"v%d" % i: "value %d" % i for i in range(size)}
+
+
+def filters(size):
+    """ Таблица из size строк с интенсивным использованием фильтров """
+    template = (
+        '<list for="row" in="rows"><p>'
+        '<var filter="length">row.name</var>|'
+        '<var filter="dateformat" dateformat-data="%d.%m.%Y">row.date</var>|'
+        '<var filter="plural_form" plural_form-data=\'["товар", "товара", "товаров"]\'>row.count</var>|'
+        '<var filter="int">row.count</var>|'
+        '<if condition="<var filter=\'in\' in-data=\'[1, 2, 3, 5, 8]\'>row.count</var>">fib</if>'
+        '</p></list>'
+    )
+    rows = [{"name": "name %d" % n, "date": datetime(2020, 1, 1 + n % 28), "count": n % 10} for n in range(size)]
+    return {"filters": template}, "filters", {"rows": rows}
+
+
+def escaping(size, columns=10):
+    """ Таблица из size строк, в каждой ячейке которой выводится строка с html-символами, требующая экранирования """
+    cells = "".join("<td><var>row.c%d</var></td>" % i for i in range(columns))
+    template = '<table><list for="row" in="rows"><tr>%s<td><var filter="html">row.raw</var></td></tr></list></table>' % cells
+    rows = [
+        dict({"c%d" % i: '<a href="/%d?x=%d&y=\'%d\'">item %d</a>' % (n, i, n, i) for i in range(columns)},
+             raw="<b>raw %d</b>" % n)
+        for n in range(size)
+    ]
+    return {"escaping": template}, "escaping", {"rows": rows}
+
+
+SCENARIOS = {
+    "wide_table": (wide_table, (100, 1000, 5000), (50,)),
+    "deep_lists": (deep_lists, (2, 4, 6), (2,)),
+    "include_in_loop": (include_in_loop, (100, 1000), (20,)),
+    "rebase_chain": (rebase_chain, (2, 8, 32), (2,)),
+    "filters": (filters, (100, 1000, 5000), (50,)),
+    "escaping": (escaping, (100, 1000, 5000), (50,)),
+}
+
+
+def cases(names=None, quick=False):
+    """
+    Возвращает сценарии всех размеров
+
+    :param names:   Имена сценариев (по умолчанию - все)
+    :param quick:   Использовать только маленькие размеры (для быстрой проверки)
+    """
+    for name, (generator, sizes, quick_sizes) in sorted(SCENARIOS.items()):
+        if names and name not in names:
+            continue
+        for size in (quick_sizes if quick else sizes):
+            files, template, data = generator(size)
+            yield Case(name, size, files, template, data)
+
+
+class Workspace(object):
+    """
+    Временный каталог views, в котором шаблоны сценариев компилируются и выполняются
+    Каждый сценарий размещается в своем подкаталоге, один каталог используется на весь запуск,
+    так как скомпилированные шаблоны импортируются как пакет views
+
+    """
+
+    def __init__(self):
+        self.root = None
+        self.cwd = None
+
+    def __enter__(self):
+        self.cwd = os.getcwd()
+        self.root = tempfile.mkdtemp(prefix="suit-benchmarks-")
+        os.mkdir(os.path.join(self.root, "views"))
+        sys.path.insert(0, self.root)
+        os.chdir(self.root)
+        return self
+
+    def __exit__(self, *exc):
+        os.chdir(self.cwd)
+        sys.path.remove(self.root)
+        for module in [name for name in sys.modules if name == "views" or name.startswith("views.")]:
+            del sys.modules[module]
+        Suit.invalidate()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def write(self, case):
+        """ Записывает исходники шаблонов сценария, возвращает имя выполняемого шаблона """
+        folder = os.path.join(self.root, "views", case.folder)
+        os.makedirs(folder, exist_ok=True)
+        for name, source in case.files.items():
+            with open(os.path.join(folder, name + ".html"), "w") as f:
+                f.write(source.replace("{folder}", case.folder))
+        return "views.%s.%s" % (case.folder, case.template)
+
+    def compile(self, compiler=None):
+        """ Компилирует новые и измененные шаблоны, возвращает компилятор """
+        compiler = compiler or Compiler()
+        os.chdir(os.path.join(self.root, "views"))
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                compiler.compile()
+        finally:
+            os.chdir(self.root)
+        return compiler
+
+    def build(self):
+        """ Собирает js и css шаблонов """
+        os.chdir(os.path.join(self.root, "views"))
+        try:
+            Compiler().build()
+        finally:
+            os.chdir(self.root)
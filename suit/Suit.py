@@ -35,15 +35,28 @@
 
 import re
 import os
+import sys
+import ast
 import json
+import hashlib
 import importlib
+import asyncio
+import threading
+import contextvars
 from html import escape, unescape
 from abc import ABCMeta, abstractmethod
+from collections import namedtuple, OrderedDict, ChainMap
+from collections.abc import Mapping
 from datetime import datetime, date, time
+from functools import lru_cache
+from time import monotonic, perf_counter
+from inspect import isawaitable
+from concurrent.futures import ProcessPoolExecutor
 
 
 SuitTags = [
-    "var", "if", "list", "breakpoint", "expression", "condition", "true", "false", "iterationvar", "iterationkey"
+    "var", "if", "list", "breakpoint", "expression", "condition", "true", "false", "iterationvar", "iterationkey",
+    "cache"
 ]
 
 
@@ -55,52 +68,134 @@ class TemplateNotFound(Exception):
     pass
 
 
-class TagCounter(object):
-    """ Counts/decounts a nested tags """
+class TagNode(object):
+    """
+    Node of the tag tree built by the Tokenizer.
+    Keeps the opening line of the tag, its closing line and the list of its parts:
+    plain text chunks (str) and nested TagNode's in order of their appearance.
+    Location is the (template name, line, column) of the tag in the template source, if it is known
+    """
+
+    def __init__(self, name, head, parts=None, close="", location=None):
+        self.name = name
+        self.head = head
+        self.parts = parts if parts is not None else []
+        self.close = close
+        self.location = location
+
+    def children(self):
+        """ Returns nested tags of the node """
+        return [part for part in self.parts if isinstance(part, TagNode)]
+
+    def body_source(self):
+        """ Returns the source text between the opening and the closing lines of the tag """
+        return "".join(part if isinstance(part, str) else part.source() for part in self.parts)
+
+    def source(self):
+        """ Returns the source text of the whole tag """
+        return self.head + self.body_source() + self.close
+
+
+class Tokenizer(object):
+    """
+    Splits a template into a tree of tags in a single pass.
+    Only the tags listed in tags_to_process become nodes of the tree, everything else is kept as text.
+    Tags inside of attribute values are kept as a part of the opening line of their owner.
+    """
 
     def __init__(self, tags_to_process=None):
         self.tags_to_process = tags_to_process or SuitTags
-        self.maxI = 0
+        self.tags_pattern = re.compile("<(/?)(%s)(?=[\s>])" % "|".join(self.tags_to_process))
+        self.head_pattern = re.compile("[<>'\"]")
 
-    def count(self, expression):
+    def parse(self, text, locations=None):
         """
-        Enumerates all the tags found in given expression, so <p><p></p></p> becomes <p_1><p_2></p_2></p_1>
-        :param expression:  Expression with some tags inside
-        :return:            Enumerated result
+        Parses given text
+        :param text:        Text with some tags inside
+        :param locations:   Locations of the tags of the text in order of their appearance (see Template.origins),
+                            trimming of spaces keeps the order and the number of tags, so the N-th location is
+                            the location of the N-th tag of the text
+        :return: list:      List of text chunks and TagNode's found on the top level of the text
         """
-        try:
-            stack = []
-            self.maxI = 0
-            p = re.compile("<(/*(%s))(\s|>)+" % "|".join(self.tags_to_process), re.DOTALL)
-            return re.sub(p, lambda tagMatch: self._manageStack(tagMatch, stack), expression)
-        except IndexError:
-            raise TemplateParseError("opening/closing tags missmatch found: %s" % expression)
-
-    def decount(self, template):
+        if locations is not None:
+            positions = [match.start() for match in self.tags_pattern.finditer(text)]
+            locations = dict(zip(positions, locations)) if len(positions) == len(locations) else {}
+        else:
+            locations = {}
+        root = TagNode(None, "")
+        stack = [root]
+        pos = 0
+        match = self.tags_pattern.search(text, pos)
+        while match is not None:
+            start = match.start()
+            if start > pos:
+                stack[-1].parts.append(text[pos:start])
+            if match.group(1):
+                close_end = text.find(">", match.end())
+                if len(stack) == 1 or stack[-1].name != match.group(2) or close_end == -1:
+                    raise TemplateParseError("opening/closing tags missmatch found: %s" % text)
+                node = stack.pop()
+                node.close = text[start:close_end + 1]
+                stack[-1].parts.append(node)
+                pos = close_end + 1
+            else:
+                head_end = self._head_end(text, start)
+                stack.append(TagNode(match.group(2), text[start:head_end], location=locations.get(start)))
+                pos = head_end
+            match = self.tags_pattern.search(text, pos)
+
+        if len(stack) > 1:
+            raise TemplateParseError("opening/closing tags missmatch found: %s" % text)
+        if pos < len(text):
+            root.parts.append(text[pos:])
+        return root.parts
+
+    def locate(self, source):
         """
-        Cleans up all enumerations from tags
-        :param template:  Enumerated template
-        :return:          Cleaned template
+        Returns locations of the tags in the source in order of their appearance
+        :param source:  Template source
+        :return: list:  [(line, column)]
         """
-        template = re.sub("<\w+(_\d+)[\s|>]+", lambda m: m.group(0).replace(m.group(1), ""), template)
-        template = re.sub("</\w+(_\d+)>", lambda m: m.group(0).replace(m.group(1), ""), template)
-        return template
-
-    def _manageStack(self, tagMatch, stack):
+        # newlines are counted only between neighbouring tags, so the scan is linear
+        locations, line, line_start, last = [], 1, 0, 0
+        for match in self.tags_pattern.finditer(source):
+            start = match.start()
+            breaks = source.count("\n", last, start)
+            if breaks:
+                line += breaks
+                line_start = source.rfind("\n", last, start) + 1
+            last = start
+            locations.append((line, start - line_start + 1))
+        return locations
+
+    def _head_end(self, text, start):
         """
-        Controls the stack of opening/closing brackets during the count() operation
-        :param tagMatch: Founded tag (opening or closing)
-        :param stack:    Current stack
-        :return:
+        Finds the end of the opening line of the tag (quotes are processed in the same way as in XmlTag.parseFirstLine)
+        :param text:    Template text
+        :param start:   Position of the tag in the text
+        :return: int:   Position right after the opening line of the tag
         """
-        tagMatch, tag = tagMatch.group(0), tagMatch.group(1)
-        if tag.startswith("/"):
-            return tagMatch.replace(tag, "%s_%s" % (tag, stack.pop()))
-        else:
-            newI = self.maxI
-            stack.append(newI)
-            self.maxI += 1
-            return tagMatch.replace(tag, "%s_%s" % (tag, newI))
+        quotes = None
+        stack, quotes_opened1, quotes_opened2 = 0, False, False
+        for match in self.head_pattern.finditer(text, start):
+            char = match.group(0)
+            if char == "<" and (quotes_opened1 is False and quotes_opened2 is False):
+                stack += 1
+            elif char == ">" and (quotes_opened1 is False and quotes_opened2 is False):
+                stack -= 1
+                if stack == 0:
+                    return match.end()
+            elif char == "'":
+                if quotes is None:
+                    quotes = "'"
+                if quotes == "'":
+                    quotes_opened1 = quotes_opened1 is False
+            elif char == '"':
+                if quotes is None:
+                    quotes = '"'
+                if quotes == '"':
+                    quotes_opened2 = quotes_opened2 is False
+        raise TemplateParseError("unclosed tag found: %s" % text[start:])
 
 
 class XmlTag(object):
@@ -109,7 +204,17 @@ class XmlTag(object):
     It represents a ordinary xml tag without any template engine logic.
     """
 
-    def __init__(self, stringTag):
+    def __init__(self, stringTag, node=None):
+        self.node = node
+        self._body = None
+        self.location = node.location if node is not None else None
+        if node is not None:
+            # the tag was already parsed by the Tokenizer, so we only need to read its attributes
+            self.stringTag = None
+            self.firstLine = node.head
+            self.name = node.name
+            self.attributes = self.parseAttributes(self.firstLine)
+            return
         self.stringTag = re.sub("\s\s+", " ", stringTag).strip()
         self.firstLine = self.parseFirstLine(self.stringTag)
         self.name = self.parseTagName(self.firstLine)
@@ -117,6 +222,26 @@ class XmlTag(object):
         self.body = self.parseBody(self.name, self.firstLine, self.stringTag)
         self.name = self.name.split("_")[0]
 
+    @property
+    def body(self):
+        """ Body of the tag (computed on demand for the tags built from TagNode) """
+        if self._body is None and self.node is not None:
+            self._body = self.node.body_source().strip()
+        return self._body
+
+    @body.setter
+    def body(self, value):
+        self._body = value
+
+    def getBodyPart(self):
+        """
+        Returns body of the tag represented by TemplatePart instance
+        :return: TemplatePart:
+        """
+        if self.node is not None:
+            return TemplatePart(None, parts=self.node.parts)
+        return TemplatePart(self.body)
+
     def get(self, attrName):
         """
         Returns an attribute value by given attribute name
@@ -175,12 +300,19 @@ class XmlTag(object):
             string = string.replace(hs, repl_map[hs])
         return string
 
+    def toNode(self):
+        """
+        Converts the tag into the node of template tree
+        :return: namedtuple:
+        """
+        raise TemplateParseError("unexpected tag found: %s" % self.firstLine)
+
 
 class Variable(XmlTag):
     """ Represents an ordinary variables """
 
-    def __init__(self, tag_string):
-        super().__init__(tag_string)
+    def __init__(self, tag_string, node=None):
+        super().__init__(tag_string, node)
         self.var_name = self._convertVarPath(self.body)
         self.default = self.attributes.get("d")
         self.filters = self.get_filters()
@@ -194,6 +326,13 @@ class Variable(XmlTag):
         result = [(f.strip(), self.attributes.get("%s-data" % f.strip())) for f in filters.split(",")]
         return list(filter(lambda it: it[0] not in [None, "None", ""], [(f[0], f[1]) for f in result]))
 
+    def toNode(self):
+        return VarNode(self.var_name, self.getFiltersTree(), buildTree(self.default))
+
+    def getFiltersTree(self):
+        """ Returns filters with their parameters converted into template trees """
+        return tuple((filter_name, buildTree(filter_data)) for filter_name, filter_data in self.filters)
+
     def _convertVarPath(self, varDottedNotation):
         """
         Converts the call to a variable from dot-notation to brackets-notation
@@ -231,50 +370,62 @@ class IterationVariable(Variable):
         res = re.sub('\["%s"\]' % self.attributes.get("name"), '[%s]' % self.attributes.get("name"), res)
         return res
 
+    def toNode(self):
+        return IterationVarNode(self.var_name, self.getFiltersTree(), buildTree(self.default))
+
 
 class IterationKey(Variable):
     """ Represents an iteration key """
 
-    def __init__(self, tag_string):
-        super().__init__(tag_string)
+    def __init__(self, tag_string, node=None):
+        super().__init__(tag_string, node)
         self.var_name = self.attributes.get("name") + (
             self.attributes.get("mod") if self.attributes.get("mod") is not None else ""
         )
 
+    def toNode(self):
+        return IterationKeyNode(self.var_name)
+
 
 class Condition(XmlTag):
     """ Represents a condition expression """
 
-    def __init__(self, tagString):
-        super().__init__(tagString)
+    def __init__(self, tagString, node=None):
+        super().__init__(tagString, node)
         self.condition = TemplatePart(
             self.attributes.get("condition")
         ) if self.attributes.get("condition") is not None else None
 
-        self.true = TemplatePart(self.body)
+        self.true = self.getBodyPart()
         self.false = TemplatePart("")
-        for t in TemplatePart(self.body).getTags():
+        for t in self.true.cdata:
             if t.name == "condition":
-                self.condition = TemplatePart(t.body)
+                self.condition = TemplatePart(None, parts=t.parts)
             elif t.name == "true":
-                self.true = TemplatePart(t.body)
+                self.true = TemplatePart(None, parts=t.parts)
             elif t.name == "false":
-                self.false = TemplatePart(t.body)
+                self.false = TemplatePart(None, parts=t.parts)
+
+    def toNode(self):
+        return ConditionNode(self.condition.getTree(), self.true.getTree(), self.false.getTree(), self.location)
 
 
 class Expression(XmlTag):
     """ Represents a simple expression that can be avaluated """
 
-    def __init__(self, tag_string):
-        super().__init__(tag_string)
-        self.expresion_body = TemplatePart(self.body)
+    def __init__(self, tag_string, node=None):
+        super().__init__(tag_string, node)
+        self.expresion_body = self.getBodyPart()
+
+    def toNode(self):
+        return ExpressionNode(self.expresion_body.getTree(), self.location)
 
 
 class List(XmlTag):
     """ Represents an iteration cycle """
 
-    def __init__(self, tagString):
-        super().__init__(tagString)
+    def __init__(self, tagString, node=None):
+        super().__init__(tagString, node)
         # parsing itervar
         itervar = self.attributes.get("for")
         if itervar.find(",") > -1:
@@ -294,7 +445,35 @@ class List(XmlTag):
             self.iterable_name = iterable
 
         # parsing template
-        self.iteration_template = TemplatePart(self.rename_iteration_variables(self.body))
+        if self.node is not None:
+            self.iteration_template = TemplatePart(None, parts=self.rename_iteration_parts(self.node.parts))
+        else:
+            self.iteration_template = TemplatePart(self.rename_iteration_variables(self.body))
+
+    def toNode(self):
+        return ListNode(self.iteration_template.getTree(), self.iterkey, self.iterable.toNode(), self.location)
+
+    def rename_iteration_parts(self, parts):
+        """
+        Renames iteration variables inside of the already parsed template.
+        Only opening lines of the nested tags and variables are rewritten, the rest of the tree is reused as is
+        :param parts:   List of text chunks and TagNode's
+        :return: list:  List of text chunks and TagNode's with renamed iteration variables
+        """
+        result = []
+        for part in parts:
+            if isinstance(part, str):
+                result.append(part)
+            elif part.name == "var":
+                source = part.source()
+                renamed = self.rename_iteration_variables(source)
+                result.append(part if renamed == source else Tokenizer().parse(renamed)[0])
+            else:
+                result.append(TagNode(
+                    part.name, self.rename_iteration_variables(part.head),
+                    self.rename_iteration_parts(part.parts), part.close, part.location
+                ))
+        return result
 
     def rename_iteration_variables(self, template):
         # converting nested lists iterables
@@ -348,17 +527,98 @@ class List(XmlTag):
 
 
 class Breakpoint(XmlTag):
-    def __init__(self, tag_string):
-        super().__init__(tag_string)
+    def __init__(self, tag_string, node=None):
+        super().__init__(tag_string, node)
         self.isInclude = self.attributes.get("include") is not None
         self.template_name = self.attributes.get("include")
-        self.content = TemplatePart(self.body)
-        self.template_data = lambda d: tag_string.replace(self.body, "")
+        self.content = self.getBodyPart()
+
+    def toNode(self):
+        if self.body and self.body.startswith("{"):
+            return IncludeNode(self.template_name, self.body, self.content.getTree(), self.location)
+        return BreakpointNode(self.content.getTree())
+
+
+class Cache(XmlTag):
+    """ Represents a fragment, which output is cached between renders """
+
+    def __init__(self, tag_string, node=None):
+        super().__init__(tag_string, node)
+        if self.attributes.get("key") is None:
+            raise TemplateParseError("key of the cache tag is required: %s" % self.firstLine)
+        self.key = TemplatePart(self.attributes.get("key"))
+        try:
+            self.ttl = float(self.attributes["ttl"]) if self.attributes.get("ttl") else None
+        except ValueError:
+            raise TemplateParseError("invalid ttl of the cache tag: %s" % self.firstLine)
+        self.content = self.getBodyPart()
+
+    def toNode(self):
+        return CacheNode(self.key.getTree(), self.ttl, self.content.getTree(), self.location)
+
+
+class Fragment(namedtuple("Fragment", "text tags")):
+    """ Template tree: text with {{ph:N}} placeholders and the tuple of nodes to be placed instead of them """
+    __slots__ = ()
+
+
+class VarNode(namedtuple("VarNode", "var_name filters default")):
+    """ <var>: path to the variable, tuple of (filter name, Fragment or None) and default value Fragment or None """
+    __slots__ = ()
+
+
+class IterationVarNode(namedtuple("IterationVarNode", "var_name filters default")):
+    """ Variable of the iteration with the index of the current item in its path """
+    __slots__ = ()
+
+
+class IterationKeyNode(namedtuple("IterationKeyNode", "var_name")):
+    """ Key (or index) of the current iteration """
+    __slots__ = ()
+
+
+class ConditionNode(namedtuple("ConditionNode", "condition true false location", defaults=(None,))):
+    """
+    <if>: condition, true and false Fragments,
+    location of the tag: (template name, line, column) in the source it comes from or None
+    """
+    __slots__ = ()
+
+
+class ListNode(namedtuple("ListNode", "template iterkey iterable location", defaults=(None,))):
+    """ <list>: Fragment for each item, name of the iteration key, VarNode of the iterable and location of the tag """
+    __slots__ = ()
+
+
+class ExpressionNode(namedtuple("ExpressionNode", "body location", defaults=(None,))):
+    """ <expression>: Fragment to be evaluated and location of the tag """
+    __slots__ = ()
+
+
+class IncludeNode(namedtuple("IncludeNode", "template_name source params location", defaults=(None,))):
+    """
+    <breakpoint include="...">: name of the included template, source and Fragment of its parameters,
+    location of the tag
+    """
+    __slots__ = ()
+
+
+class BreakpointNode(namedtuple("BreakpointNode", "content")):
+    """ <breakpoint>: Fragment of its content """
+    __slots__ = ()
+
+
+class CacheNode(namedtuple("CacheNode", "key ttl content location", defaults=(None,))):
+    """
+    <cache>: Fragment of the key, time to live in seconds (or None), Fragment of the cached content
+    and location of the tag
+    """
+    __slots__ = ()
 
 
 SuitTagsMap = {
     "var": Variable, "iterationvar": IterationVariable, "iterationkey": IterationKey,
-    "if": Condition, "list": List, "expression": Expression, "breakpoint": Breakpoint
+    "if": Condition, "list": List, "expression": Expression, "breakpoint": Breakpoint, "cache": Cache
 }
 
 
@@ -371,34 +631,28 @@ class TemplatePart(object):
     but it's a normal TemplatePart string
     """
 
-    def __init__(self, text, tags_to_process=None):
-        text = trimSpaces(text)
-        self.text = text
+    def __init__(self, text, tags_to_process=None, parts=None, locations=None):
         self.cdata = []
-        self.tags = None
-        self.tags_pattern = None
-        self.tags_counter = TagCounter(tags_to_process)
+        self.tree = None
+        self.tags = tags_to_process or SuitTags
+        if parts is None:
+            parts = Tokenizer(self.tags).parse(trimSpaces(text), locations)
+        self.text = self.parseTags(parts)
 
-        if tags_to_process is None:
-            tags_to_process = SuitTags
-        self.parseTags(tags_to_process)
-
-    def parseTags(self, tags_to_process):
+    def parseTags(self, parts):
         """
-        Defines tags to be parsed from template
-        :param: list:   tags_to_process:    List of tag names to be parsed from template
+        Replaces tags found on the top level of the template with placeholders
+        :param: list:   parts:  List of text chunks and TagNode's produced by Tokenizer
+        :return: str:   Template text with placeholders
         """
-        self.tags = tags_to_process
-        self.tags_pattern = re.compile(
-            '<(?P<tagName>(?:%s)+(_\d+)?)(?:\s.+?)*>(?:.?)*</(?P=tagName)>' % (
-                "|".join(tags_to_process)
-            ), re.DOTALL
-        )
-        self.text = re.sub(
-            self.tags_pattern,
-            lambda m: "{{ph:%d}}" % (self.cdata.append(m.group(0)) or len(self.cdata) - 1),
-            self.tags_counter.count(self.text)
-        )
+        text = []
+        for part in parts:
+            if isinstance(part, str):
+                text.append(part)
+            else:
+                text.append("{{ph:%d}}" % len(self.cdata))
+                self.cdata.append(part)
+        return "".join(text).strip(" ")
 
     def getText(self):
         """
@@ -414,52 +668,225 @@ class TemplatePart(object):
         Returns a list of all tags found in Template Part and defined by setTags() method
         :return: list
         """
-        return self.cdata
+        return [node.source() for node in self.cdata]
 
     def getTags(self):
         """
         Returns a list of the XmlTag objects corresponding to getData() method
         :return:
         """
-        return [self.toSuitTag(tag_text) for tag_text in self.cdata]
+        return [self.toSuitTag(node) for node in self.cdata]
 
     def getDataForCompile(self):
         """
-        Returns a tuple (text, tags) for compiler
-        :return: tuple
+        Returns the template tree (Fragment of text and tags) for compiler
+        :return: Fragment
         """
-        return self.getText(), self.getTags()
+        return self.getTree()
 
-    def toSuitTag(self, tag_text):
-        name = tag_text.split(" ")[0].split(">")[0].replace("<", "").split("_")[0]
-        suit_tag = SuitTagsMap.get(name) or XmlTag
-        return suit_tag(tag_text)
+    def getTree(self):
+        """
+        Returns the template tree of the part.
+        The tree is built once and then shared by all language engines
+        :return: Fragment
+        """
+        if self.tree is None:
+            self.tree = Fragment(self.text, tuple(tag.toNode() for tag in self.getTags()))
+        return self.tree
 
+    def toSuitTag(self, node):
+        suit_tag = SuitTagsMap.get(node.name) or XmlTag
+        return suit_tag(None, node)
 
-class Template(object):
-    def __init__(self, templateName):
-        self.tags_counter = TagCounter()
-        self.templateName = templateName
 
-        # На случай если идет обращение по абсолютному пути ищем шаблон поднимаясь по дереву директорий:
-        initial_dir = os.path.realpath(os.path.curdir)
-        if not os.path.isfile(templateName):
-            first, *tale = templateName.split("/")
+def buildTree(text):
+    """ Returns the template tree for given text (or None) """
+    return TemplatePart(text).getTree() if text is not None else None
+
+
+class ConstantFolder(object):
+    """
+    Optimization pass over the template tree, which evaluates nodes not depending on the data at compile time:
+    static conditions and expressions on literals. Folded nodes become literal text of the tree, which is compiled
+    by all engines, so only the code evaluated the same way by python and javascript is folded: integer arithmetic
+    (without division) and single comparisons of numbers
+    """
+
+    placeholder = re.compile("\{\{ph:(\d+)\}\}")
+    operators = {
+        ast.Add: lambda a, b: a + b, ast.Sub: lambda a, b: a - b, ast.Mult: lambda a, b: a * b,
+        ast.USub: lambda a: -a, ast.UAdd: lambda a: +a,
+        ast.Eq: lambda a, b: a == b, ast.NotEq: lambda a, b: a != b, ast.Lt: lambda a, b: a < b,
+        ast.LtE: lambda a, b: a <= b, ast.Gt: lambda a, b: a > b, ast.GtE: lambda a, b: a >= b
+    }
+    # integers of javascript are exact up to 2 ** 53
+    max_int = 2 ** 53
+
+    def __init__(self):
+        self.folded = 0
+
+    def fold(self, tree):
+        """
+        Returns the tree with folded nodes (nodes are folded bottom-up)
+        :param tree:    Fragment
+        :return:        Fragment
+        """
+        if tree is None:
+            return None
+        text, tags = [], []
+        for i, piece in enumerate(self.placeholder.split(tree.text)):
+            if i % 2 == 0:
+                text.append(piece)
+                continue
+            node = self.fold_node(tree.tags[int(piece)])
+            if isinstance(node, str):
+                self.folded += 1
+                text.append(node)
+            elif isinstance(node, Fragment):
+                self.folded += 1
+                for j, inner in enumerate(self.placeholder.split(node.text)):
+                    if j % 2 == 0:
+                        text.append(inner)
+                    else:
+                        text.append("{{ph:%d}}" % len(tags))
+                        tags.append(node.tags[int(inner)])
+            else:
+                text.append("{{ph:%d}}" % len(tags))
+                tags.append(node)
+        return Fragment("".join(text), tuple(tags))
+
+    def fold_node(self, node):
+        """ Returns the node with folded children, its literal text or the Fragment to be placed instead of it """
+        if isinstance(node, ConditionNode):
+            node = ConditionNode(
+                self.fold(node.condition), self.fold(node.true), self.fold(node.false), node.location
+            )
+            if not node.condition.tags:
+                value = self.evaluate(node.condition.text)
+                if value is not self:
+                    return (node.true if value else node.false) or Fragment("", ())
+            return node
+        if isinstance(node, ExpressionNode):
+            node = ExpressionNode(self.fold(node.body), node.location)
+            if not node.body.tags:
+                value = self.evaluate(node.body.text)
+                if value is not self and not isinstance(value, bool):
+                    return str(value)
+            return node
+        if isinstance(node, ListNode):
+            return ListNode(self.fold(node.template), node.iterkey, node.iterable, node.location)
+        if isinstance(node, BreakpointNode):
+            return BreakpointNode(self.fold(node.content))
+        if isinstance(node, CacheNode):
+            return CacheNode(node.key, node.ttl, self.fold(node.content), node.location)
+        return node
+
+    def evaluate(self, code):
+        """ Evaluates the code of literals (returns the folder itself if the code can't be folded) """
+        try:
+            return self.value(ast.parse(code.strip(), "<constant>", "eval").body)
+        except (SyntaxError, ValueError):
+            return self
+
+    def value(self, node):
+        """
+        Returns the value of the expression node
+        :raises ValueError: if the node can't be folded
+        """
+        if isinstance(node, ast.Constant) and type(node.value) is int:
+            value = node.value
+        elif isinstance(node, ast.BinOp) and type(node.op) in self.operators:
+            value = self.operators[type(node.op)](self.value(node.left), self.value(node.right))
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in self.operators:
+            value = self.operators[type(node.op)](self.value(node.operand))
+        elif isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in self.operators:
+            value = self.operators[type(node.ops[0])](self.value(node.left), self.value(node.comparators[0]))
+        else:
+            raise ValueError("not a constant")
+        if type(value) is int and abs(value) > self.max_int:
+            raise ValueError("integer out of range")
+        return value
+
+
+class TemplateLoader(object):
+    """
+    Finds and reads template sources inside of given search roots.
+    Never changes the working directory, so it can be safely used from many threads.
+    Keeps an index of already found templates, which is invalidated when the template file is modified
+    """
+
+    def __init__(self, roots=None):
+        self.roots = [os.path.realpath(root) for root in (roots or [os.curdir])]
+        self.index = {}
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        return {"roots": self.roots}
+
+    def __setstate__(self, state):
+        self.__init__(state["roots"])
+
+    def find(self, templateName):
+        """
+        Returns an absolute path to the template
+        If template is not found in the root itself, it is looked up in the parent directories of the root,
+        so templates can be referenced by their absolute names (views/subfolder/template.html)
+        :param templateName:    Relative path to the template
+        :return: str:           Absolute path to the template
+        """
+        first = templateName.split("/")[0]
+        for root in self.roots:
+            path = os.path.join(root, templateName)
+            if os.path.isfile(path):
+                return path
             attempts = 10
-            while os.path.basename(os.path.realpath(os.path.curdir)) and os.path.basename(
-                    os.path.realpath(os.path.curdir)) != first and attempts > 0:
+            while os.path.basename(root) and os.path.basename(root) != first and attempts > 0:
                 attempts -= 1
-                os.chdir("../")
-            os.chdir("../")
-            if not os.path.isfile(templateName):
-                raise TemplateNotFound("template %s not found" % templateName)
+                root = os.path.dirname(root)
+            path = os.path.join(os.path.dirname(root), templateName)
+            if os.path.isfile(path):
+                return path
+        raise TemplateNotFound("template %s not found" % templateName)
 
-        f = open(templateName)
-        self.content = "".join(f.readlines())
-        f.close()
-        os.chdir(initial_dir)
+    def load(self, templateName):
+        """
+        Returns the path to the template and its source
+        :param templateName:    Relative path to the template
+        :return: tuple:         (absolute path, source)
+        """
+        with self.lock:
+            cached = self.index.get(templateName)
+            if cached is not None:
+                path, mtime, content = cached
+                try:
+                    if os.stat(path).st_mtime_ns == mtime:
+                        return path, content
+                except OSError:
+                    pass
+            path = self.find(templateName)
+            mtime = os.stat(path).st_mtime_ns
+            with open(path) as f:
+                content = f.read()
+            self.index[templateName] = (path, mtime, content)
+            return path, content
+
+    def relpath(self, path):
+        """ Returns path relative to the first search root """
+        return os.path.relpath(path, self.roots[0])
 
-        self.content = re.sub("<!--(.+?)-->", "", self.content)  # cut all comments
+
+class Template(object):
+    def __init__(self, templateName, loader=None):
+        self.templateName = templateName
+        self.loader = loader if loader is not None else TemplateLoader()
+        path, self.content = self.loader.load(templateName)
+        self.path = self.loader.relpath(path)
+        self.hash = hashlib.md5(self.content.encode()).hexdigest()
+        self.dependencies = []
+        # (template name, line, column) of each tag of the content in the source it comes from
+        self.origins = [(templateName, line, column) for line, column in Tokenizer().locate(self.content)]
+
+        self._splice([(m.start(), m.end(), "", []) for m in re.finditer("<!--(.+?)-->", self.content)])  # cut comments
         self.css, self.js = None, None
         self.parse_resources("css", "<style(?:\s.+?)*>(.*?)</style>")  # cut & save css
         self.parse_resources("js", "<script>(.*?)</script>")  # cut & save js
@@ -469,6 +896,17 @@ class Template(object):
     def getContent(self):
         return self.content
 
+    def getDependencies(self):
+        """
+        Returns all templates (rebased and included) this template depends on, including indirect ones
+        :return: dict:  map of dependencies {path: content hash}
+        """
+        dependencies = {}
+        for dependency in self.dependencies:
+            dependencies[dependency.path] = dependency.hash
+            dependencies.update(dependency.getDependencies())
+        return dependencies
+
     def getBreakPoints(self, content, all_levels=False):
         """
         Returns a map of all breakpoints found in template.
@@ -478,24 +916,64 @@ class Template(object):
         :param content:     Content to be parsed
         :return: dict:      map of breakpoints {name: tag}
         """
-        content = self.tags_counter.count(content)
         breakpointsMap = {}
-        bps = re.findall('(<breakpoint(?P<brcount>[_\d]*)(?:\s.+?)*>.*?</breakpoint(?P=brcount)>)', content, re.DOTALL)
-        for bp in bps:
-            bp_element = Breakpoint(bp[0])
-            if bp_element.get("name"):
-                breakpointsMap[bp_element.get("name")] = self.tags_counter.decount(bp[0])
-                if all_levels:
-                    nextLevel = self.getBreakPoints(bp_element.body, all_levels)
-                    for bpname in nextLevel:
-                        breakpointsMap[bpname] = nextLevel[bpname]
+        self._collectBreakPoints(Tokenizer().parse(content), breakpointsMap, all_levels)
         return breakpointsMap
 
+    def _collectBreakPoints(self, parts, breakpointsMap, all_levels):
+        """ Walks through the tag tree and fills the map of breakpoints """
+        for node in parts:
+            if isinstance(node, str):
+                continue
+            if node.name != "breakpoint":
+                self._collectBreakPoints(node.parts, breakpointsMap, all_levels)
+            else:
+                bp_element = Breakpoint(None, node)
+                if bp_element.get("name"):
+                    breakpointsMap[bp_element.get("name")] = node.source()
+                    if all_levels:
+                        self._collectBreakPoints(node.parts, breakpointsMap, all_levels)
+
+    def _splice(self, spans):
+        """
+        Replaces fragments of the content and keeps origins of its tags in step:
+        origins of the tags of a replaced fragment are dropped, the replacement brings origins of its own tags
+        :param spans:   Sorted non-overlapping list of (start, end, replacement, origins of the replacement tags)
+        """
+        tags = Tokenizer().tags_pattern
+        content, origins, pos, index = [], [], 0, 0
+        for start, end, replacement, replacement_origins in spans:
+            kept = len(tags.findall(self.content, pos, start))
+            content += [self.content[pos:start], replacement]
+            origins += self.origins[index:index + kept] + replacement_origins
+            index += kept + len(tags.findall(self.content, start, end))
+            pos = end
+        content.append(self.content[pos:])
+        origins += self.origins[index:]
+        self.content, self.origins = "".join(content), origins
+
+    def _occurrences(self, fragment, replacement, origins):
+        """ Returns spans replacing all occurrences of the fragment in the content (the same way as str.replace) """
+        spans, start = [], self.content.find(fragment)
+        while fragment and start > -1:
+            spans.append((start, start + len(fragment), replacement, origins))
+            start = self.content.find(fragment, start + len(fragment))
+        return spans
+
+    def _origins_of(self, fragment):
+        """ Returns origins of the tags of the fragment of the content """
+        tags = Tokenizer().tags_pattern
+        start = self.content.find(fragment)
+        if start == -1:
+            return []
+        index = len(tags.findall(self.content, 0, start))
+        return self.origins[index:index + len(tags.findall(fragment))]
+
     def parse_resources(self, res_type, regexp):
         """ Excludes all css styles from template and stores them in self """
         match = re.search(regexp, self.content, re.DOTALL)
         if match is not None:
-            self.content = self.content.replace(match.group(0), "")
+            self._splice(self._occurrences(match.group(0), "", []))
             self.__dict__[res_type] = match.group(1)
 
     def rebase(self):
@@ -503,121 +981,186 @@ class Template(object):
         parentTemplateName = re.search('<rebase(?:\s.+?)*>(.+?)</rebase>', self.content, re.DOTALL)
         if parentTemplateName is None:
             return
-        parent = Template(parentTemplateName.group(1).strip("'").strip("\"").replace(".", "/") + ".html")
+        parent = Template(parentTemplateName.group(1).strip("'").strip("\"").replace(".", "/") + ".html", self.loader)
+        self.dependencies.append(parent)
+        # collapsing of spaces keeps the tags, so the origins of the parent are kept as they are
         parent.content = re.sub("\s\s+", " ", parent.content).strip()
-        rebased_template = re.sub("\s\s+", " ", parent.content).strip()
         bp_parent = parent.getBreakPoints(parent.content, all_levels=True)
         bp_current = self.getBreakPoints(self.content)
+        overrides = {bp_name: (bp_current[bp_name], self._origins_of(bp_current[bp_name])) for bp_name in bp_current}
+        self.content, self.origins = re.sub("\s\s+", " ", parent.content).strip(), list(parent.origins)
         for bp_name in bp_parent:
             if bp_current.get(bp_name):
-                rebased_template = rebased_template.replace(bp_parent[bp_name], bp_current[bp_name])
-        self.content = rebased_template
+                self._splice(self._occurrences(bp_parent[bp_name], *overrides[bp_name]))
 
     def include(self):
         """ Includes all sub templates if template contains <breakpoint> tags with 'include' attribute """
-        self.content = re.sub(
-            '(<breakpoint(?P<brcount>(?:_\d+)?) include=(.+?)></breakpoint(?P=brcount)>)',
-            lambda m: Template(m.group(3).strip("'").strip("\"").replace(".", "/") + ".html").getContent(),
-            self.content
-        )
+        self._splice([
+            (m.start(), m.end()) + self._includeTemplate(m.group(3).strip("'").strip("\"").replace(".", "/") + ".html")
+            for m in re.finditer(
+                '(<breakpoint(?P<brcount>(?:_\d+)?) include=(.+?)></breakpoint(?P=brcount)>)', self.content
+            )
+        ])
 
-    def compile(self, languageEnginesMap):
+    def _includeTemplate(self, templateName):
+        """ Returns content of the included template with origins of its tags and remembers it as a dependency """
+        included = Template(templateName, self.loader)
+        self.dependencies.append(included)
+        return included.getContent(), included.origins
+
+    def compile(self, languageEnginesMap, profile=False):
         """
         Compiles itself into source code according given map
         :param languageEnginesMap:
+        :param profile: whether the python code should collect statistics of SuitProfiler
         :return:
         """
-        template_part = TemplatePart(self.content)
-        compiled = {
-            language: languageEnginesMap[language]().compile(
-                template_part.getDataForCompile()
-            ) for language in languageEnginesMap
-        }
+        folder = ConstantFolder()
+        tree = folder.fold(TemplatePart(self.content, locations=self.origins).getTree())
+        self.folded = folder.folded
+        engines = {language: languageEnginesMap[language]() for language in languageEnginesMap}
+        if profile:
+            engines["py"].profile = self.templateName
+        compiled = {language: engines[language].compile(tree) for language in engines}
+        stream = engines["py"].compile_stream(tree) or ['\t\tyield ""']
 
         # Compiling python source
         templateName = self.templateName.replace(".html", "").replace("/", "_")
-        pythonSource = "from suit.Suit import Suit, SuitRunTime, SuitNone, SuitFilters\n" \
+        pythonSource = "from suit.Suit import Suit, SuitRunTime, SuitNone, SuitFilters, SuitProfiler\n" \
+                       "%s" \
                        "class %s(object):\n" \
-                       "\tdef execute(self, data={}):\n" \
-                       "\t\tself.data = data\n" \
-                       "\t\treturn (%s)" % (templateName, compiled["py"])
-        f = open("__py__/%s" % self.templateName.replace("/", "_").replace("html", "py"), "w+")
-        f.writelines(pythonSource)
-        f.close()
+                       "\tdef execute(self, _context={}):\n" \
+                       "\t\treturn (%s)\n" \
+                       "\tasync def render(self, _context={}):\n" \
+                       "\t\treturn await SuitRunTime.render(self.execute, _context)\n" \
+                       "\tdef render_iter(self, _context={}):\n" \
+                       "%s" % (engines["py"].definitions_source(), templateName, compiled["py"], "\n".join(stream))
+        writeAtomic("__py__/%s" % self.templateName.replace("/", "_").replace("html", "py"), pythonSource)
 
         # Build css
-        f = open("__css__/%s" % self.templateName.replace("/", "_").replace("html", "css"), "w+")
-        f.writelines("".join(self.css or ""))
-        f.close()
+        writeAtomic("__css__/%s" % self.templateName.replace("/", "_").replace("html", "css"), "".join(self.css or ""))
 
         # Build js
         jsCompiled = compiled["js"]
         jsApiInit = self.js.strip() if self.js else "null"
-        jsSource = 'suit.SuitApi.addTemplate({template}, {jsCompiled}, {jsApiInit});\n' \
+        jsSource = engines["js"].definitions_source() + 'suit.SuitApi.addTemplate({template}, {jsCompiled}, {jsApiInit});\n' \
             .format(
             template='"%s"' % self.templateName.replace(".html", "").replace("/", "."),
             jsCompiled='function(data) {data = data || {}; return %s}' % jsCompiled,
             jsApiInit=jsApiInit
         )
+        writeAtomic("__js__/%s" % self.templateName.replace("/", "_").replace("html", "js"), jsSource)
 
-        f = open("__js__/%s" % self.templateName.replace("/", "_").replace("html", "js"), "w+")
-        f.writelines(jsSource)
-        f.close()
+
+def writeAtomic(path, content):
+    """
+    Writes content into the file, so readers never see a partially written file
+    :param path:    Path to the file
+    :param content: Content to be written
+    """
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, "w+") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def compileTemplate(target, languageEnginesMap, loader=None, profile=False):
+    """
+    Compiles a template (used by Compiler in worker processes)
+    :param target:              Path to the template
+    :param languageEnginesMap:  Map of language engines
+    :param loader:              TemplateLoader to find the template and its dependencies
+    :param profile:             Whether the python code should collect statistics of SuitProfiler
+    :return: tuple:             (template hash, template dependencies, number of folded nodes)
+    """
+    template = Template(target, loader)
+    template.compile(languageEnginesMap, profile)
+    return template.hash, template.getDependencies(), template.folded
 
 
 class Syntax(metaclass=ABCMeta):
     """ Abstract Class For Creating Language Engines """
 
-    def try_compile(self, text):
-        """ Tries to compile given string """
-        if text is not None:
-            return self.compile(TemplatePart(text).getDataForCompile())
+    def try_compile(self, tree):
+        """ Tries to compile given template tree """
+        if tree is not None:
+            return self.compile(tree)
 
-    def compile_tag(self, tag):
-        """ Compiles given SuitTag into source code """
+    def compile_tag(self, tag, raw=False):
+        """ Compiles given node of the template tree into source code (raw values are not stringified) """
 
-        if isinstance(tag, IterationKey):
+        if isinstance(tag, IterationKeyNode):
             return tag.var_name
 
-        elif isinstance(tag, IterationVariable):
-            filters = [
-                lambda var: self.filter(filter_name, var, self.try_compile(filter_data))
-                for filter_name, filter_data in tag.filters
-            ]
-            return self.var(tag.var_name, filters, self.try_compile(tag.default))
-
-        elif isinstance(tag, Variable):
-            filters = [
-                lambda var: self.filter(filter_name, var, self.try_compile(filter_data))
-                for filter_name, filter_data in tag.filters
-            ]
-            return self.var(tag.var_name, filters, self.try_compile(tag.default))
+        elif isinstance(tag, (VarNode, IterationVarNode)):
+            return self.var(tag.var_name, self.filters(tag.filters), self.try_compile(tag.default), without_stringify=raw)
 
-        elif isinstance(tag, Condition):
+        elif isinstance(tag, ConditionNode):
             return self.condition(
-                self.compile(tag.condition.getDataForCompile()),
-                self.compile(tag.true.getDataForCompile()),
-                self.compile(tag.false.getDataForCompile())
+                self.compile_condition(tag.condition),
+                self.compile(tag.true),
+                self.compile(tag.false)
             )
 
-        elif isinstance(tag, List):
+        elif isinstance(tag, ListNode):
             return self.list(
-                self.compile(tag.iteration_template.getDataForCompile()),
+                self.compile(tag.template),
                 tag.iterkey,
                 self.var(tag.iterable.var_name, without_stringify=True)
             )
 
-        elif isinstance(tag, Expression):
-            return self.expression(self.compile(tag.expresion_body.getDataForCompile()))
+        elif isinstance(tag, ExpressionNode):
+            return self.compile_expression(tag.body)
 
-        elif isinstance(tag, Breakpoint):
-            if tag.body and tag.body.startswith("{"):
-                return self.include(tag.template_name, tag.body)
-            else:
-                return self.compile(tag.content.getDataForCompile())
+        elif isinstance(tag, IncludeNode):
+            return self.include(tag.template_name, tag.source, tag.params, tag.location)
+
+        elif isinstance(tag, BreakpointNode):
+            return self.compile(tag.content)
+
+        elif isinstance(tag, CacheNode):
+            return self.cache(self.compile(tag.key), tag.ttl, self.compile(tag.content))
 
         else:
-            raise None
+            raise TemplateParseError("unexpected node found: %s" % repr(tag))
+
+    def filters(self, filters):
+        """ Returns functions, which wrap the source code of a variable with given filters """
+        return [
+            lambda var, filter_name=filter_name, filter_data=filter_data:
+                self.filter(filter_name, var, self.filter_data(filter_name, filter_data))
+            for filter_name, filter_data in filters
+        ]
+
+    # filters, which literal json data (lists and dicts) is parsed at compile time
+    literal_filters = ("in", "notin", "plural_form", "plural_word")
+
+    def filter_data(self, filter_name, tree):
+        """ Compiles data of the filter, literal json data of literal_filters is parsed at compile time """
+        if tree is not None and not tree.tags and filter_name in self.literal_filters:
+            try:
+                value = json.loads(tree.text)
+            except ValueError:
+                value = None
+            if isinstance(value, (list, dict)):
+                return self.literal(filter_name, value)
+        return self.try_compile(tree)
+
+    def literal(self, filter_name, value):
+        """ Compiles data of the filter, parsed at compile time """
+        return json.dumps(value)
+
+    def cache(self, key, ttl, content):
+        """ Compiles the <cache> tag (engines without a fragment cache render its content each time) """
+        return content
+
+    def compile_condition(self, tree):
+        """ Compiles the condition of the <if> tag """
+        return self.compile(tree)
+
+    def compile_expression(self, tree):
+        """ Compiles the body of the <expression> tag """
+        return self.expression(self.compile(tree))
 
     @abstractmethod
     def compile(self, data):
@@ -632,7 +1175,7 @@ class Syntax(metaclass=ABCMeta):
         pass
 
     @abstractmethod
-    def include(self, bp_name, bp_body):
+    def include(self, bp_name, bp_body, bp_params, location=None):
         pass
 
     @abstractmethod
@@ -669,6 +1212,53 @@ class PythonSyntax(Syntax):
     Класс, обеспечивающий возможность компиляции шаблонов в исходный код python
     """
 
+    path_component = re.compile(r'''\[(?:"([^"\\]*)"|(-?\d+)|([A-Za-z_]\w*))\]''')
+
+    # узлы, время выполнения которых измеряется при компиляции с профилированием
+    profiled_nodes = (ListNode, ConditionNode, ExpressionNode, IncludeNode, CacheNode)
+
+    def __init__(self):
+        self.definitions = OrderedDict()
+        self.scope = []
+        self.profile = None
+        self.streams = 0
+
+    def compile_tag(self, tag, raw=False):
+        if self.profile is not None and isinstance(tag, self.profiled_nodes):
+            return "SuitProfiler.measure(%r, lambda: %s)" % (self.profile_key(tag), self.compile_node(tag, raw))
+        return self.compile_node(tag, raw)
+
+    def profile_key(self, tag):
+        """
+        Возвращает ключ статистики профилирования тега: (имя шаблона, тег и его строка:колонка в исходном файле)
+        Для тегов родительских и включаемых шаблонов указывается и имя файла, из которого они взяты
+
+        :param tag:     Узел дерева шаблона
+        """
+        if isinstance(tag, IncludeNode):
+            name = "include %s" % tag.template_name
+        else:
+            name = {ListNode: "list", ConditionNode: "if", ExpressionNode: "expression", CacheNode: "cache"}[type(tag)]
+        if tag.location is not None:
+            template, line, column = tag.location
+            where = "%d:%d" % (line, column) if template == self.profile else "%s:%d:%d" % tag.location
+            name = "%s at %s" % (name, where)
+        return self.profile, name
+
+    def compile_node(self, tag, raw=False):
+        """ Компилирует узел дерева шаблона (без профилирования) """
+        if isinstance(tag, ListNode):
+            self.scope.append((tag.iterkey, self.var_path(tag.iterable.var_name)))
+            try:
+                return super().compile_tag(tag, raw)
+            finally:
+                self.scope.pop()
+        if isinstance(tag, (VarNode, IterationVarNode)) and tag.filters and tag.filters[0][0] == "html":
+            # фильтр html отменяет экранирование, поэтому значение берется без экранирования
+            return self.var(tag.var_name, self.filters(tag.filters[1:]), self.try_compile(tag.default),
+                            without_stringify=raw, escape=False)
+        return super().compile_tag(tag, raw)
+
     def compile(self, data):
         template, tags = data
         template = template.replace('"', '\\"')
@@ -682,13 +1272,62 @@ class PythonSyntax(Syntax):
     def convertplaceholders(self, template):
         return re.sub("\{\{ph:\d+\}\}", "%s", template)
 
-    def include(self, bp_name, bp_body):
-        return "SuitRunTime.include({}, '%s', lambda: self.data, '%s')" % (bp_name, bp_body)
+    def include(self, bp_name, bp_body, bp_params, location=None):
+        where = "%s:%d:%d" % location if location is not None else None
+        params = self.include_params(bp_params, bp_name, where) if bp_params is not None else None
+        if params is not None:
+            return "SuitRunTime.include_scope('%s', _context, %s)" % (bp_name, params)
+        return "SuitRunTime.include({}, '%s', lambda: _context, '%s', %r)" % (bp_name, bp_body, where)
 
-    def var(self, var_name, filters=None, default=None, without_stringify=False):
+    def include_params(self, tree, template_name, where=None):
+        """
+        Компилирует параметры включаемого шаблона ({"a": <var>b</var>}) в код, который сразу строит словарь
+
+        :param tree:            Дерево параметров
+        :param template_name:   Имя включаемого шаблона (для сообщений об ошибках в параметрах)
+        :param where:           Место тега включения: "шаблон:строка:колонка" (для сообщений об ошибках)
+        :return:        Исходный код словаря или None, если параметры нельзя скомпилировать заранее
+                        (например, если они формируются условиями или циклами)
+        """
+        text, tags = tree
+        code, skeleton = [], []
+        for i, segment in enumerate(self.string_literal.split(text)):
+            if i % 2:
+                code.append(self.condition_literal(segment, tags))
+                skeleton.append(segment)
+                continue
+            values = [tags[int(n)] for n in re.findall("\{\{ph:(\d+)\}\}", segment)]
+            if not all(isinstance(tag, (VarNode, IterationVarNode, IterationKeyNode, ExpressionNode)) for tag in values):
+                return None
+            segment = re.sub(r"\btrue\b", "True", segment)
+            segment = re.sub(r"\bfalse\b", "False", segment)
+            segment = re.sub(r"\bnull\b", "None", segment)
+            skeleton.append(re.sub("\{\{ph:\d+\}\}", "0", segment))
+            code.append(re.sub(
+                "\{\{ph:(\d+)\}\}",
+                lambda m: "SuitRunTime.parameter(%s, '%s', %r)" % (
+                    self.compile_tag(tags[int(m.group(1))], raw=True), template_name, where
+                ),
+                segment
+            ))
+        try:
+            if not isinstance(ast.literal_eval("".join(skeleton).strip()), dict):
+                return None
+        except (ValueError, SyntaxError):
+            return None
+        return "".join(code).strip()
+
+    def var(self, var_name, filters=None, default=None, without_stringify=False, escape=True):
         if filters is None:
             filters = []
-        res = "SuitRunTime.var(lambda self: self.data%s, %s, self)" % (var_name, default)
+        path = self.var_path(var_name)
+        if path is not None:
+            source, path, dynamic = self.bind(*path)
+            res = "%s(%s, %s)" % (self.accessor(path, escape), source, ", ".join([str(default)] + dynamic))
+        else:
+            res = "SuitRunTime.var(lambda _context: _context%s, %s, _context)" % (var_name, default)
+            if not escape:
+                res = self.filter("html", res)
         for filter_lambda in filters:
             res = filter_lambda(res)
         if without_stringify is False:
@@ -696,14 +1335,179 @@ class PythonSyntax(Syntax):
         else:
             return res
 
+    def var_path(self, var_name):
+        """
+        Разбирает путь до переменной на компоненты
+
+        :param var_name:    Путь до переменной в скобочной нотации: ["items"][item]["name"]
+        :return: tuple:     (путь, в котором None обозначает переменные циклов, список переменных циклов)
+                            или None, если путь нельзя разобрать
+        """
+        path, dynamic, pos = [], [], 0
+        for m in self.path_component.finditer(var_name):
+            if m.start() != pos:
+                return None
+            pos = m.end()
+            if m.group(1) is not None:
+                path.append(m.group(1))
+            elif m.group(2) is not None:
+                path.append(int(m.group(2)))
+            elif any(m.group(3) == itervar for itervar, _ in self.scope):
+                path.append(None)
+                dynamic.append(m.group(3))
+            else:
+                return None
+        if pos != len(var_name) or not path:
+            return None
+        return tuple(path), dynamic
+
+    def bind(self, path, dynamic):
+        """
+        Находит ближайший цикл, элемент которого является началом пути до переменной,
+        чтобы переменная разрешалась от текущего элемента цикла, а не от корня данных
+
+        :param path:        Путь до переменной (None обозначает переменные циклов)
+        :param dynamic:     Переменные циклов, входящие в путь
+        :return: tuple:     (исходный код объекта, от которого разрешается путь, остаток пути, переменные циклов остатка)
+        """
+        for itervar, iterable in reversed(self.scope):
+            if itervar not in dynamic or iterable is None:
+                continue
+            j = len(dynamic) - 1 - dynamic[::-1].index(itervar)
+            p = [i for i, key in enumerate(path) if key is None][j]
+            if (path[:p], dynamic[:j]) == iterable:
+                return "_item_%s" % itervar, path[p + 1:], dynamic[j + 1:]
+        return "_context", path, dynamic
+
+    def accessor(self, path, escape=True):
+        """
+        Возвращает имя функции доступа к переменной по указанному пути
+
+        :param path:        Путь до переменной
+        :param escape:      Экранировать ли html в строковых значениях
+        """
+        return self.define("SuitRunTime.accessor(%r%s)" % (path, "" if escape else ", False"), "_path")
+
+    def literal(self, filter_name, value):
+        """
+        Возвращает имя константы с данными фильтра, разобранными при компиляции
+
+        :param filter_name:     Имя фильтра
+        :param value:           Данные фильтра
+        """
+        if filter_name in ("in", "notin"):
+            items = list(value.keys()) if isinstance(value, dict) else value
+            try:
+                frozenset(items)
+                return self.define("frozenset(%r)" % (items,), "_data")
+            except TypeError:
+                pass
+        return self.define(repr(tuple(value) if isinstance(value, list) else value), "_data")
+
+    def define(self, source, prefix):
+        """
+        Возвращает имя, под которым значение будет определено на уровне модуля (однократно)
+
+        :param source:      Исходный код значения
+        :param prefix:      Префикс имени
+        """
+        name = self.definitions.get(source)
+        if name is None:
+            name = self.definitions[source] = "%s%d" % (prefix, len(self.definitions))
+        return name
+
+    def definitions_source(self):
+        """ Возвращает исходный код определений уровня модуля """
+        return "".join(["%s = %s\n" % (name, source) for source, name in self.definitions.items()])
+
+    def definitions_namespace(self):
+        """ Возвращает определения уровня модуля для выполнения скомпилированного кода без модуля """
+        return {name: eval(source, {"SuitRunTime": SuitRunTime, "SuitFilters": SuitFilters, "SuitProfiler": SuitProfiler}) for source, name in self.definitions.items()}
+
+    def compile_condition(self, tree):
+        """
+        Компилирует условие тега <if> в нативное выражение python
+
+        Переменные подставляются в выражение как значения (а не как текст, который затем передавался в eval),
+        переменные внутри строковых литералов подставляются конкатенацией строк
+        """
+        text, tags = tree
+        code = self.native(text, tags)
+        try:
+            compile(code, "<condition>", "eval")
+        except SyntaxError:
+            raise TemplateParseError("invalid condition: %s" % text.strip())
+        return code
+
+    def native(self, text, tags):
+        """
+        Компилирует текст условия или выражения в нативный код python: переменные становятся операндами
+        (SuitRunTime.operand), переменные внутри строковых литералов подставляются конкатенацией строк
+
+        :param text:        Текст с плейсхолдерами переменных
+        :param tags:        Узлы шаблона, на которые ссылаются плейсхолдеры
+        """
+        code = []
+        for i, segment in enumerate(self.string_literal.split(text)):
+            if i % 2:
+                code.append(self.condition_literal(segment, tags))
+            else:
+                code.append(re.sub(
+                    "\{\{ph:(\d+)\}\}",
+                    lambda m: "SuitRunTime.operand(%s)" % self.compile_tag(tags[int(m.group(1))], raw=True),
+                    self.operators(segment)
+                ))
+        return "".join(code).strip()
+
+    def operators(self, segment):
+        """ Заменяет логические операторы и литералы javascript в тексте условия (вне строковых литералов) """
+        segment = segment.replace("&&", " %s " % self.logicand()).replace("||", " %s " % self.logicor())
+        segment = re.sub(r"\btrue\b", self.true(), segment)
+        return re.sub(r"\bfalse\b", self.false(), segment)
+
+    string_literal = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')''')
+
+    def condition_literal(self, literal, tags):
+        """
+        Компилирует строковый литерал из условия, в котором могут встречаться переменные
+
+        :param literal:     Строковый литерал вместе с кавычками
+        :param tags:        Узлы шаблона, на которые ссылаются плейсхолдеры
+        """
+        quote, pieces = literal[0], re.split("\{\{ph:(\d+)\}\}", literal[1:-1])
+        if len(pieces) == 1:
+            return literal
+        parts = [
+            "str(%s)" % self.compile_tag(tags[int(piece)]) if i % 2 else quote + piece + quote
+            for i, piece in enumerate(pieces) if i % 2 or piece
+        ]
+        return "(%s)" % " + ".join(parts)
+
     def condition(self, condition, true, false):
-        condition = condition.replace("&&", self.logicand())
-        condition = condition.replace("||", self.logicor())
-        condition = condition.replace("true", self.true())
-        condition = condition.replace("false", self.false())
-        return '''SuitRunTime.opt(%s, lambda: %s, lambda: %s)''' % (condition, true, false if false else "")
+        return "((%s) if %s else (%s))" % (true, self.decided(condition), false if false else '""')
+
+    def decided(self, condition):
+        """
+        Оборачивает условие так, чтобы при асинхронном выполнении ветка не выбиралась по неготовым данным
+
+        :param condition:   Исходный код условия
+        """
+        return "SuitRunTime.decided(SuitRunTime.mark(), %s)" % condition
 
     def list(self, template, itervar, iterable):
+        template = self.include_itervar(template, itervar)
+        return '''SuitRunTime.list_items(lambda %s, _item_%s: %s, %s)''' % (itervar, itervar, template, iterable)
+
+    def cache(self, key, ttl, content):
+        return "SuitRunTime.cache(%s, %r, lambda: %s)" % (key, ttl, content)
+
+    def include_itervar(self, template, itervar):
+        """
+        Передает переменную цикла в данные первого включаемого шаблона
+
+        :param template:    Скомпилированное тело цикла
+        :param itervar:     Имя переменной цикла
+        """
         inc_data = re.search("SuitRunTime.include\(({.*?}), ", template, re.DOTALL)
         inc_data = inc_data.group(1) if inc_data else "{}"
         new_inc_data = inc_data
@@ -711,17 +1515,119 @@ class PythonSyntax(Syntax):
             iter_addition = '''"%s": %s''' % (itervar, itervar)
             new_inc_data = '{%s}' % iter_addition if len(inc_data) == 2 else inc_data.rstrip(
                 "}") + ", " + iter_addition + "}"
-        template = template.replace("SuitRunTime.include(%s, " % inc_data, "SuitRunTime.include(%s, " % new_inc_data)
-        return '''SuitRunTime.list(lambda %s: %s, %s)''' % (itervar, template, iterable)
+        return template.replace("SuitRunTime.include(%s, " % inc_data, "SuitRunTime.include(%s, " % new_inc_data)
+
+    def compile_stream(self, tree, depth=2, itervars=()):
+        """
+        Компилирует дерево шаблона в тело генератора, который отдает результат частями:
+        статический текст отдается по мере достижения, циклы - построчно
+
+        :param tree:        Дерево шаблона
+        :param depth:       Уровень отступа генерируемого кода
+        :param itervars:    Переменные объемлющих циклов
+        :return: list:      Строки исходного кода
+        """
+        text, tags = tree
+        indent = "\t" * depth
+        lines = []
+        for i, piece in enumerate(re.split("\{\{ph:(\d+)\}\}", text)):
+            if i % 2 == 0:
+                if piece:
+                    lines.append("%syield %s" % (indent, self.compile(Fragment(piece, ()))))
+                continue
+            tag = tags[int(piece)]
+            if isinstance(tag, ListNode) and tag.iterkey not in itervars or isinstance(tag, ConditionNode):
+                if self.profile is None:
+                    lines += self.stream_block(tag, depth, itervars)
+                else:
+                    lines += self.profile_stream(tag, self.stream_block(tag, depth + 1, itervars), depth)
+            elif isinstance(tag, BreakpointNode):
+                lines += self.compile_stream(tag.content, depth, itervars)
+            else:
+                code = self.compile_tag(tag)
+                for itervar in reversed(itervars):
+                    code = self.include_itervar(code, itervar)
+                lines.append("%syield str(%s)" % (indent, code))
+        return lines
+
+    def stream_block(self, tag, depth, itervars):
+        """
+        Компилирует цикл или условие для потокового выполнения: в цикл и ветки, а не в одно выражение
+
+        :param tag:         ListNode или ConditionNode
+        :param depth:       Уровень отступа генерируемого кода
+        :param itervars:    Переменные объемлющих циклов
+        :return: list:      Строки исходного кода
+        """
+        indent = "\t" * depth
+        lines = []
+        if isinstance(tag, ListNode):
+            self.scope.append((tag.iterkey, self.var_path(tag.iterable.var_name)))
+            lines.append("%sfor %s, _item_%s in SuitRunTime.iterate_items(%s):" % (
+                indent, tag.iterkey, tag.iterkey, self.var(tag.iterable.var_name, without_stringify=True)
+            ))
+            lines += self.compile_stream(tag.template, depth + 1, itervars + (tag.iterkey,)) or [indent + "\tpass"]
+            self.scope.pop()
+        else:
+            lines.append("%sif %s:" % (indent, self.decided(self.compile_condition(tag.condition))))
+            lines += self.compile_stream(tag.true, depth + 1, itervars) or [indent + "\tpass"]
+            false = self.compile_stream(tag.false, depth + 1, itervars)
+            if false:
+                lines.append("%selse:" % indent)
+                lines += false
+        return lines
+
+    def profile_stream(self, tag, block, depth):
+        """
+        Оборачивает код потокового выполнения тега во вложенный генератор, части которого учитывает SuitProfiler
+
+        :param tag:     Узел дерева шаблона
+        :param block:   Строки исходного кода тега с отступом depth + 1
+        :param depth:   Уровень отступа генерируемого кода
+        :return: list:  Строки исходного кода
+        """
+        indent = "\t" * depth
+        self.streams += 1
+        name = "_stream%d" % self.streams
+        return ["%sdef %s():" % (indent, name)] + block + [
+            "%syield from SuitProfiler.stream(%r, %s())" % (indent, self.profile_key(tag), name)
+        ]
+
+    def compile_expression(self, tree):
+        """
+        Компилирует тег <expression>
+
+        Выражение без имен компилируется в нативный код так же, как условие: переменные подставляются как значения.
+        Выражения с именами (и выражения, которые становятся кодом только после подстановки текста переменных)
+        вычисляются во время выполнения через кеш скомпилированных выражений
+        """
+        text, tags = tree
+        skeleton = "".join(
+            '""' if i % 2 else re.sub("\{\{ph:\d+\}\}", "_operand", self.operators(segment))
+            for i, segment in enumerate(self.string_literal.split(text))
+        )
+        try:
+            parsed = ast.parse("(%s)" % skeleton.strip(), "<expression>", "eval")
+        except SyntaxError:
+            if not tags:
+                raise TemplateParseError("invalid expression: %s" % text.strip())
+            return self.expression(self.compile(tree))
+        if any(isinstance(node, ast.Name) and node.id != "_operand" for node in ast.walk(parsed)):
+            return self.expression(self.compile(tree))
+        return "(%s)" % self.native(text, tags)
 
     def expression(self, expression):
         return "SuitRunTime.expression(%s)" % expression
 
     def filter(self, filterName, var, data=None):
+        function = "SuitFilters.get(%r)" % filterName
+        if self.profile is not None:
+            function = "SuitProfiler.wrap(%r, %s)" % ((self.profile, "filter %s" % filterName), function)
+        function = self.define(function, "_filter")
         if data is None:
-            return '''SuitFilters._%s(%s)''' % (filterName, var)
+            return '''%s(%s)''' % (function, var)
         else:
-            return '''SuitFilters._%s(%s, %s)''' % (filterName, var, data)
+            return '''%s(%s, %s)''' % (function, var, data)
 
     def logicand(self):
         return "and"
@@ -742,6 +1648,16 @@ class JavascriptSyntax(Syntax):
 
     """
 
+    def __init__(self):
+        self.definitions = OrderedDict()
+
+    def definitions_source(self):
+        """ Возвращает исходный код регистрации пользовательских фильтров, используемых шаблоном """
+        return "".join([
+            "suit.SuitFilters.register(%s, %s);\n" % (json.dumps(name), source.strip())
+            for name, source in self.definitions.items()
+        ])
+
     def compile(self, data):
         template, tags = data
         template = template.replace('"', '\\"')
@@ -754,9 +1670,8 @@ class JavascriptSyntax(Syntax):
     def convertplaceholders(self, template):
         return re.sub('\{\{ph:(\d+)\}\}', lambda m: "{%s}" % m.group(1), template)
 
-    def include(self, bp_name, bp_body):
-        template_part = TemplatePart(bp_body)
-        compiled = self.compile(template_part.getDataForCompile())
+    def include(self, bp_name, bp_body, bp_params, location=None):
+        compiled = self.compile(bp_params)
         compiled = '''function(data) { return %s ; }''' % compiled
         return "suit.SuitRunTime.include({}, '%s', function() { return data }, %s)" % (bp_name, compiled)
 
@@ -791,6 +1706,10 @@ class JavascriptSyntax(Syntax):
         return "eval(%s)" % expression
 
     def filter(self, filterName, var, data=None):
+        custom = SuitFilters.registry.get(filterName)
+        if custom is not None and custom.js is not None:
+            self.definitions[filterName] = custom.js
+            return "suit.SuitFilters.custom[%s](%s, %s)" % (json.dumps(filterName), var, data or "null")
         if filterName == "length":
             var = '''suit.SuitFilters.get_length(%s, %s)''' % (var, var)
         elif filterName == "startswith":
@@ -822,23 +1741,138 @@ class JavascriptSyntax(Syntax):
 
 
 class Compiler(object):
-    def compile(self, path="."):
+    manifest_file = "__py__/manifest.json"
+    languages = {"py": PythonSyntax, "js": JavascriptSyntax}
+
+    def __init__(self, profile=False):
+        """
+        :param profile:     Компилировать python-код шаблонов с профилированием (см. SuitProfiler)
+        """
+        self.profile = profile
+        self.compiled = 0
+        self.skipped = 0
+        self.folded = 0
+
+    def compile(self, path=".", jobs=1):
         """
         Компилирует все найденные шаблоны внутри указанного каталога
+        Шаблоны, исходники которых (и всех шаблонов, от которых они зависят) не изменились
+        с момента предыдущей компиляции, пропускаются
 
         :param path:    Путь до каталога с шаблонами
+        :param jobs:    Количество процессов, компилирующих шаблоны параллельно
         """
         self._checkCompiledPackage()
+        self.compiled, self.skipped, self.folded = 0, 0, 0
+        loader = TemplateLoader()
+        manifest = self._loadManifest()
+        hashes = {}
+        targets = []
+        for target in self._findTemplates(path):
+            if self._isUpToDate(target, manifest["templates"].get(target), hashes):
+                self.skipped += 1
+            else:
+                targets.append(target)
+
+        if jobs > 1 and len(targets) > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                results = executor.map(
+                    compileTemplate, targets, [self.languages] * len(targets), [loader] * len(targets),
+                    [self.profile] * len(targets),
+                    chunksize=max(1, len(targets) // (jobs * 4))
+                )
+                for target, result in zip(targets, results):
+                    print(target)
+                    self._remember(manifest, target, result)
+        else:
+            for target in targets:
+                print(target)
+                self._remember(manifest, target, compileTemplate(target, self.languages, loader, self.profile))
+        self._saveManifest(manifest)
+
+    def _remember(self, manifest, target, result):
+        """ Запоминает в манифесте результат компиляции шаблона """
+        template_hash, dependencies, folded = result
+        manifest["templates"][target] = {"hash": template_hash, "dependencies": dependencies}
+        self.compiled += 1
+        self.folded += folded
+        Suit.invalidate(path=self._compiledFiles(target)[0])
+
+    def _findTemplates(self, path):
+        """
+        Ищет все шаблоны внутри указанного каталога (рекурсивно)
+
+        :param path:    Путь до каталога с шаблонами
+        """
         for file in os.listdir(path):
             target = (path + "/" + file) if path != "." else file
             if os.path.isdir(target):
-                self.compile(target)
+                yield from self._findTemplates(target)
             elif os.path.isfile(target):
                 if self._isTemplateName(target) is False:
                     continue
-                template = Template(target)
-                print(target)
-                template.compile({"py": PythonSyntax, "js": JavascriptSyntax})
+                yield target
+
+    def _isUpToDate(self, target, record, hashes):
+        """
+        Проверяет, что шаблон и все шаблоны, от которых он зависит, не изменились с момента последней компиляции,
+        а результаты компиляции на месте
+
+        :param target:  Путь до шаблона
+        :param record:  Запись о шаблоне в манифесте
+        :param hashes:  Кэш хэшей исходников, уже посчитанных в рамках текущей компиляции
+        """
+        if record is None:
+            return False
+        for compiled_file in self._compiledFiles(target):
+            if os.path.isfile(compiled_file) is False:
+                return False
+        sources = dict(record["dependencies"])
+        sources[target] = record["hash"]
+        for source, source_hash in sources.items():
+            if source not in hashes:
+                hashes[source] = self._hash(source)
+            if hashes[source] != source_hash:
+                return False
+        return True
+
+    def _compiledFiles(self, target):
+        """ Возвращает пути до файлов, получаемых при компиляции шаблона """
+        name = target.replace("/", "_")
+        return ["__%s__/%s" % (ext, name.replace("html", ext)) for ext in ["py", "js", "css"]]
+
+    def _hash(self, path):
+        """ Возвращает хэш исходника шаблона (или None, если шаблона больше нет) """
+        if os.path.isfile(path) is False:
+            return None
+        with open(path) as f:
+            return hashlib.md5(f.read().encode()).hexdigest()
+
+    def _signature(self):
+        """ Возвращает подпись компилятора: при ее изменении все шаблоны будут перекомпилированы """
+        from suit import __version__
+        with open(__file__, "rb") as f:
+            return "%s:%s%s" % (__version__, hashlib.md5(f.read()).hexdigest(), ":profile" if self.profile else "")
+
+    def _loadManifest(self):
+        """ Загружает манифест предыдущей компиляции """
+        signature = self._signature()
+        if os.path.isfile(self.manifest_file):
+            try:
+                with open(self.manifest_file) as f:
+                    manifest = json.load(f)
+                if manifest.get("signature") == signature:
+                    return manifest
+            except ValueError:
+                pass
+        return {"signature": signature, "templates": {}}
+
+    def _saveManifest(self, manifest):
+        """ Сохраняет манифест, забывая о шаблонах, которых больше нет """
+        manifest["templates"] = {
+            target: record for target, record in manifest["templates"].items() if os.path.isfile(target)
+        }
+        writeAtomic(self.manifest_file, json.dumps(manifest, indent=1, sort_keys=True))
 
     def build(self):
         """
@@ -866,9 +1900,7 @@ class Compiler(object):
                 all_content += f.readlines()
                 f.close()
 
-        f = open("__%s__/all.%s" % (fileType, fileType), "w+")
-        f.writelines("".join(all_content))
-        f.close()
+        writeAtomic("__%s__/all.%s" % (fileType, fileType), "".join(all_content))
 
     def _build_catalog(self, path, fileType):
         """
@@ -893,9 +1925,7 @@ class Compiler(object):
                 content += f.readlines()
                 f.close()
 
-        f = open("__%s__/all.%s.%s" % (fileType, path.replace("/", "."), fileType), "w+")
-        f.writelines("".join(content))
-        f.close()
+        writeAtomic("__%s__/all.%s.%s" % (fileType, path.replace("/", "."), fileType), "".join(content))
 
     def _checkCompiledPackage(self):
         """
@@ -945,30 +1975,195 @@ class Compiler(object):
 # ########################################## RunTime Classes ##########################################################
 
 
+class LRUCache(object):
+    """
+    Thread-safe dictionary of limited size, which drops least recently used items when it is full.
+    Counts hits, misses and evictions, so its efficiency can be monitored
+    maxsize=None makes the cache unbounded
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key, default=None):
+        """ Returns cached value (or default) and marks it as recently used """
+        with self.lock:
+            try:
+                value = self.items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """ Puts value into the cache, evicting the least recently used items if needed """
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while self.maxsize is not None and len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+                self.evictions += 1
+
+    def copy(self):
+        """ Returns a copy of cached items """
+        with self.lock:
+            return dict(self.items)
+
+    def pop(self, key, default=None):
+        """ Removes the item from the cache """
+        with self.lock:
+            return self.items.pop(key, default)
+
+    def clear(self):
+        """ Removes all items and resets counters """
+        with self.lock:
+            self.items.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """ Returns counters of the cache """
+        return {
+            "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+            "size": len(self.items), "maxsize": self.maxsize
+        }
+
+
+class FragmentCache(LRUCache):
+    """
+    Storage of the output of <cache> tags: LRU cache, which items also expire after their time to live
+    A shared store (e.g. memcached or redis) is plugged by assigning an object with the same interface
+    (get, set, invalidate, stats) to SuitRunTime.fragments
+    """
+
+    def __init__(self, maxsize=1024, clock=monotonic):
+        super().__init__(maxsize)
+        self.clock = clock
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        """ Returns cached value (or default, if it is missing or expired) and marks it as recently used """
+        with self.lock:
+            try:
+                value, expires = self.items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= self.clock():
+                del self.items[key]
+                self.misses += 1
+                self.expirations += 1
+                return default
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """ Puts value into the cache for ttl seconds (None - until it is evicted) """
+        super().set(key, (value, self.clock() + ttl if ttl is not None else None))
+
+    def invalidate(self, prefix=""):
+        """
+        Removes items, which keys start with the prefix (all items by default)
+        :return: number of removed items
+        """
+        with self.lock:
+            keys = [key for key in self.items if key.startswith(prefix)]
+            for key in keys:
+                del self.items[key]
+            return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.expirations = 0
+        super().clear()
+
+    def stats(self):
+        return dict(super().stats(), expirations=self.expirations)
+
+
 class Suit(object):
     """
     Suit execution wrapper
     """
 
+    # process-wide registry of compiled templates: name -> class (maxsize can be set to bound it)
+    registry = LRUCache(maxsize=None)
+    # compiled inline templates: source -> function
+    inline = LRUCache(maxsize=512)
+
     def __init__(self, path):
         if not path.startswith("{"):
-            path = path.split(".")
-            self.template = None
+            self.template = Suit.load(path)()
+        else:
+            self.template = Suit.inline.get(path)
+            if self.template is None:
+                self.template = Suit.compileInline(path)
+                Suit.inline.set(path, self.template)
+
+    @staticmethod
+    def compileInline(source):
+        """
+        Compiles an inline template ("{...}", e.g. parameters of an include) into a function
+        :param source:  source of the template
+        :return:        function(data) of data for template execution
+        """
+        syntax = PythonSyntax()
+        compiled = "lambda _context: %s" % syntax.compile(TemplatePart(source).getTree())
+        compiled = re.sub('\[itervar_(.+?)\]', lambda m: '[_context["itervar_%s"]]' % m.group(1), compiled)
+        return eval(compile(compiled, "<inline template>", "eval"), dict(globals(), **syntax.definitions_namespace()))
+
+    @staticmethod
+    def load(templateName):
+        """
+        Returns the class of a compiled template
+        Classes are imported once and then kept in Suit.registry
+        :param templateName: dotted name of the template (views.subfolder.template)
+        :return:             class of the compiled template
+        """
+        template_class = Suit.registry.get(templateName)
+        if template_class is None:
+            path = templateName.split(".")
             for i in range(len(path)):
                 cpath = "%s/__py__/" % "/".join(path[:len(path) - i])
                 if os.path.isdir(cpath):
                     template_name_part = "_".join(path[len(path) - i:])
                     module = importlib.import_module("%s%s" % (cpath.replace("/", "."), template_name_part))
                     template_class = getattr(module, template_name_part)
-                    self.template = template_class()
-            if not self.template:
+            if template_class is None:
                 raise TemplateNotFound("template not found")
-        else:
-            template_part = TemplatePart(path)
-            compiled = PythonSyntax().compile(template_part.getDataForCompile())
-            self.template = "lambda self: %s" % compiled
-            self.template = re.sub('\[itervar_(.+?)\]', lambda m: '[self.data["itervar_%s"]]' % m.group(1),
-                                   self.template)
+            Suit.registry.set(templateName, template_class)
+        return template_class
+
+    @staticmethod
+    def invalidate(templateName=None, path=None):
+        """
+        Removes templates from the registry, so they are imported again when they are used next time
+        :param templateName: dotted name of the template
+        :param path:         path to the compiled python module of the template
+        If neither is given, the registry is cleared
+        """
+        if path is not None:
+            path = os.path.realpath(path)
+        for name, template_class in Suit.registry.copy().items():
+            if templateName is not None and name != templateName:
+                continue
+            module = sys.modules.get(template_class.__module__)
+            if path is not None and os.path.realpath(getattr(module, "__file__", None) or "") != path:
+                continue
+            Suit.registry.pop(name)
+            sys.modules.pop(template_class.__module__, None)
+        importlib.invalidate_caches()
 
     def execute(self, data=None):
         """
@@ -978,23 +2173,101 @@ class Suit(object):
         """
         if data is None:
             data = {}
-        if hasattr(self.template, "execute"):
-            res = self.template.execute(data)
-            # поддержка internal.data, suit.environment и auto-refresh на стороне клиента:
-            if res.startswith("<!DOCTYPE html>") and res.find("auto-refresh") > -1:
-                exclude = data.get("suit_environment_exclude")
-                if exclude:
-                    suit_env_data = {key: val for key, val in data.items() if key not in exclude}
-                else:
-                    suit_env_data = data
-                res = res.replace("</head>",
-                                  '''<script id="suit_environment_script">window.suit_environment='%s'</script></head>''' % json_safedumps(
-                                      suit_env_data))
-            return res
-        else:
-            # noinspection PyAttributeOutsideInit
-            self.data = data
-            return eval(self.template)(self)
+        # encoded lists and dicts of the data are shared by all templates (and includes) of the render
+        token = SuitRunTime.rendered.set({}) if SuitRunTime.rendered.get() is None else None
+        try:
+            if hasattr(self.template, "execute"):
+                return self.environment(self.template.execute(data), data)
+            else:
+                return self.template(data)
+        finally:
+            if token is not None:
+                SuitRunTime.rendered.reset(token)
+
+    async def render(self, data=None):
+        """
+        Executes a template asynchronously, awaitable values of the data are awaited when they are referenced
+        :param data: data for template execution
+        :return:     result of template execution
+        """
+        return await SuitRunTime.render(self.execute, {} if data is None else data)
+
+    def render_iter(self, data=None, encoding="utf-8", buffer_size=8192):
+        """
+        Executes a template progressively, so the result can be sent by chunks (e.g. as a WSGI iterable)
+        The beginning of an html document is buffered up to </head> to support suit.environment
+        :param data:        data for template execution
+        :param encoding:    encoding of the chunks (WSGI requires bytes), None to get chunks as strings
+        :param buffer_size: pieces of the result are joined into chunks of at least this number of characters
+        :return:            generator of result chunks
+        """
+        if data is None:
+            data = {}
+        # the render runs in its own context, so the generator can be consumed anywhere (and in any thread)
+        context = contextvars.copy_context()
+        if context.run(SuitRunTime.rendered.get) is None:
+            context.run(SuitRunTime.rendered.set, {})
+        pieces, size = self.pieces(data), 0
+        buffered = []
+        while True:
+            try:
+                piece = context.run(next, pieces)
+            except StopIteration:
+                break
+            buffered.append(piece)
+            size += len(piece)
+            if size >= buffer_size:
+                chunk, buffered, size = "".join(buffered), [], 0
+                yield chunk if encoding is None else chunk.encode(encoding)
+        if buffered:
+            chunk = "".join(buffered)
+            yield chunk if encoding is None else chunk.encode(encoding)
+
+    def pieces(self, data):
+        """
+        Executes a template progressively
+        :param data: data for template execution
+        :return:     generator of pieces of the result, as they are rendered
+        """
+        if not hasattr(self.template, "render_iter"):
+            yield self.execute(data)
+            return
+        buffered = []
+        for chunk in self.template.render_iter(data):
+            if buffered is None:
+                yield chunk
+                continue
+            buffered.append(chunk)
+            res = "".join(buffered)
+            if res.startswith("<!DOCTYPE html>"):
+                if res.find("</head>") == -1:
+                    continue
+                res = self.environment(res, data)
+            elif "<!DOCTYPE html>".startswith(res):
+                continue
+            buffered = None
+            yield res
+        if buffered:
+            yield self.environment("".join(buffered), data)
+
+    @staticmethod
+    def environment(res, data):
+        """
+        Adds suit.environment to the html document (support of internal.data, suit.environment and auto-refresh)
+        :param res:  result of template execution
+        :param data: data for template execution
+        :return:     result of template execution with suit.environment
+        """
+        if res.startswith("<!DOCTYPE html>") and res.find("auto-refresh") > -1:
+            exclude = data.get("suit_environment_exclude")
+            if exclude:
+                suit_env_data = {key: val for key, val in data.items() if key not in exclude}
+            else:
+                suit_env_data = data
+            res = res.replace("</head>",
+                              '''<script id="suit_environment_script">window.suit_environment='%s'</script></head>''' % json_safedumps(
+                                  suit_env_data))
+        return res
 
 
 def suit(templateName):
@@ -1020,13 +2293,156 @@ def suit(templateName):
     return decorator
 
 
+class Markup(str):
+    """
+    String of trusted html, which is printed by templates as is (without escaping)
+    Values of template data are marked as safe by wrapping them: Markup("<b>bold</b>")
+    Objects with __html__ method (e.g. markupsafe.Markup) are treated the same way
+    """
+    __slots__ = ()
+
+    def __html__(self):
+        return self
+
+
+class JavascriptLiteralEncoder(json.JSONEncoder):
+    """
+    Json encoder, which escapes string literals of the result, so it can be placed inside a quoted javascript literal
+    Strings are escaped by the encoder itself as they are encoded, so the result needs no further passes
+    """
+
+    # characters of string literals, which are escaped differently from json (and everything outside of ascii)
+    escaped = re.compile(r'[\\"\'\n\r]|[^\ -~]')
+    replacements = {"\\": "\\\\\\\\", '"': '\\\\"', "'": "\\'", "\n": "", "\r": ""}
+
+    def literal(self, string):
+        """ Returns the escaped json literal of the string """
+        return '"%s"' % self.escaped.sub(self.escape, string)
+
+    def escape(self, match):
+        """ Returns the escape sequence of the character """
+        char = match.group(0)
+        if char in self.replacements:
+            return self.replacements[char]
+        return json.encoder.encode_basestring_ascii(char)[1:-1]
+
+    def encode(self, obj):
+        return "".join(self.iterencode(obj, _one_shot=True))
+
+    def iterencode(self, obj, _one_shot=False):
+        markers = {} if self.check_circular else None
+        if _one_shot and json.encoder.c_make_encoder is not None and self.indent is None:
+            encoder = json.encoder.c_make_encoder(
+                markers, self.default, self.literal, self.indent, self.key_separator, self.item_separator,
+                self.sort_keys, self.skipkeys, self.allow_nan
+            )
+        else:
+            encoder = json.encoder._make_iterencode(
+                markers, self.default, self.literal, self.indent, self.floatstr, self.key_separator,
+                self.item_separator, self.sort_keys, self.skipkeys, _one_shot
+            )
+        return encoder(obj, 0)
+
+    def floatstr(self, value):
+        """ Returns the json representation of the float (as json.JSONEncoder does) """
+        if value != value:
+            text = "NaN"
+        elif value in (float("inf"), float("-inf")):
+            text = "Infinity" if value > 0 else "-Infinity"
+        else:
+            return float.__repr__(value)
+        if not self.allow_nan:
+            raise ValueError("Out of range float values are not JSON compliant: %r" % value)
+        return text
+
+
+class JsonEncoder(object):
+    """
+    Encodes lists and dicts printed by templates and the data of suit.environment
+    Can be replaced by assigning an object with the same interface to SuitRunTime.encoder
+    """
+
+    def __init__(self):
+        self.encoder = json.JSONEncoder(default=self.default)
+        self.safe_encoder = JavascriptLiteralEncoder(default=self.default)
+
+    def default(self, obj):
+        """
+        Encodes objects, which are not supported by json
+        Awaitable values are encoded by their results during an asynchronous render (see SuitRunTime.render)
+        """
+        if isawaitable(obj):
+            return SuitRunTime.resolve(obj) if SuitRunTime.resolver.get() is not None else None
+        return json_dumps_handler(obj)
+
+    def dumps(self, obj):
+        """ Returns json representation of the object """
+        return self.encoder.encode(obj)
+
+    def safedumps(self, obj):
+        """ Returns json representation of the object, which can be placed inside a quoted javascript literal """
+        return self.safe_encoder.encode(obj)
+
+
+class AwaitableResolver(object):
+    """
+    Awaitable values of the data of an asynchronous render
+    Values are collected while a template is executed and then awaited together, results are kept by id
+    """
+
+    class Pending(Exception):
+        """ A condition depends on a value, which is not awaited yet, so the rest of the pass is not executed """
+        pass
+
+    def __init__(self):
+        self.results = {}
+        self.pending = OrderedDict()
+        self.misses = 0
+
+    def resolve(self, awaitable):
+        """ Returns the result of the awaitable or None, if it is not awaited yet (it is awaited after the pass) """
+        result = self.results.get(id(awaitable))
+        if result is not None and result[0] is awaitable:
+            return result[1]
+        self.pending[id(awaitable)] = awaitable
+        self.misses += 1
+        return None
+
+    async def gather(self):
+        """ Awaits all pending awaitables concurrently """
+        pending = list(self.pending.values())
+        self.pending.clear()
+        for awaitable, result in zip(pending, await asyncio.gather(*pending)):
+            self.results[id(awaitable)] = (awaitable, result)
+
+
 class SuitRunTime(object):
     """ RunTime helpers """
 
+    expressions = LRUCache(1024)
+    encoder = JsonEncoder()
+    # encoded lists and dicts of the current render: id -> (object, json)
+    rendered = contextvars.ContextVar("rendered", default=None)
+    # awaitable values of the current asynchronous render
+    resolver = contextvars.ContextVar("resolver", default=None)
+    # output of <cache> tags (see FragmentCache for the interface of a shared store)
+    fragments = FragmentCache()
+
     @staticmethod
     def stringify(obj):
-        """ Prints variable """
-        return json.dumps(obj, default=json_dumps_handler) if isinstance(obj, (list, dict)) else obj
+        """
+        Prints variable
+        Lists and dicts are encoded once per render (data is not modified during rendering)
+        """
+        if not isinstance(obj, (list, dict)):
+            return obj
+        rendered = SuitRunTime.rendered.get()
+        if rendered is None:
+            return SuitRunTime.encoder.dumps(obj)
+        cached = rendered.get(id(obj))
+        if cached is None or cached[0] is not obj:
+            cached = rendered[id(obj)] = (obj, SuitRunTime.encoder.dumps(obj))
+        return cached[1]
 
     @staticmethod
     def var(lambdavar, default, context):
@@ -1034,7 +2450,7 @@ class SuitRunTime(object):
         Calls variable in safe way, avoids exceptions and return SuitNone() in case of missing required variable
         :param lambdavar:  lambda function, which should return a variable's value
         :param default:    default value
-        :param context:    execution context (object that contains template's data in it's attributes)
+        :param context:    execution context passed to the lambda function (data of the template)
         """
 
         def safedefault():
@@ -1043,9 +2459,11 @@ class SuitRunTime(object):
 
         try:
             res = lambdavar(context)
+            if isawaitable(res):
+                res = SuitRunTime.resolve(res)
             if res is None:
                 return safedefault()
-            return escape(res, quote=True) if isinstance(res, str) else res
+            return SuitRunTime.escape(res) if isinstance(res, str) else res
         except NameError:
             return safedefault()
         except KeyError:
@@ -1055,63 +2473,439 @@ class SuitRunTime(object):
         except TypeError:
             return safedefault()
 
+    accessors = {}
+
     @staticmethod
-    def opt(condition, true, false):
+    def accessor(path, escape=True):
         """
-        Returns the result depending on evaluating of the condition
-        :param condition:   string condition
-        :param true:        lambda function used if condition is true
-        :param false:       lambda function used if condition is false
-        :return:
+        Returns a function, which safely walks through the data by the path without raising exceptions
+        Returns default value or SuitNone() in case of missing variable (as SuitRunTime.var does)
+        :param path:    tuple of keys and indexes, None marks keys passed to the function at runtime (iteration keys)
+        :param escape:  whether html in string values should be escaped
+        :return:        function(data, default, *iteration_keys)
+        """
+        accessor = SuitRunTime.accessors.get((path, escape))
+        if accessor is not None:
+            return accessor
+
+        def lookup(obj, key):
+            if isinstance(obj, Mapping):
+                return obj.get(key, lookup)
+            if isinstance(obj, (list, tuple, str)):
+                return obj[key] if isinstance(key, int) and -len(obj) <= key < len(obj) else lookup
+            if isawaitable(obj):
+                obj = SuitRunTime.resolve(obj)
+                return lookup if obj is None else lookup(obj, key)
+            try:
+                return obj[key]
+            except (KeyError, IndexError, TypeError):
+                return lookup
+
+        def settle(obj, default):
+            if isawaitable(obj):
+                obj = SuitRunTime.resolve(obj)
+                if obj is None:
+                    return default if default is not None else SuitNone()
+            return SuitRunTime.escape(obj) if escape and isinstance(obj, str) else obj
+
+        # the function is generated for each path, so no loops and no closures are used during access
+        args, steps = [], []
+        for key in path:
+            index = "\t\telif c is list and -len(obj) <= {key} < len(obj): obj = obj[{key}]\n"
+            if key is None:
+                key = "k%d" % len(args)
+                args.append(key)
+                index = "\t\telif c is list and {key}.__class__ is int and -len(obj) <= {key} < len(obj): obj = obj[{key}]\n"
+            elif isinstance(key, str):
+                key, index = repr(key), ""
+            steps.append((
+                "\t\tc = obj.__class__\n"
+                "\t\tif c is dict: obj = obj.get({key}, lookup)\n" + index +
+                "\t\telse: obj = lookup(obj, {key})\n"
+                "\t\tif obj is lookup: return default if default is not None else SuitNone()\n"
+            ).format(key=key))
+        source = "def access(obj, default%s):\n" \
+                 "\ttry:\n%s" \
+                 "\texcept TypeError:\n" \
+                 "\t\treturn default if default is not None else SuitNone()\n" \
+                 "\tif obj is None: return default if default is not None else SuitNone()\n" \
+                 "\tc = obj.__class__\n" \
+                 "%s" \
+                 "\tif c in plain: return obj\n" \
+                 "\treturn settle(obj, default)\n" % (
+                     "".join(", " + arg for arg in args), "".join(steps) or "\t\tpass\n",
+                     "\tif c is str: return escape(obj)\n" if escape else ""
+                 )
+        namespace = {
+            "lookup": lookup, "settle": settle, "escape": SuitRunTime.escape, "SuitNone": SuitNone,
+            "plain": frozenset((str, int, float, bool, dict, list, tuple, SuitNone))
+        }
+        exec(source, namespace)
+        access = namespace["access"]
+        SuitRunTime.accessors[(path, escape)] = access
+        return access
+
+    @staticmethod
+    def cache(key, ttl, content):
+        """
+        Returns the cached output of a <cache> tag, rendering and storing it on a miss
+        :param key:         key of the fragment
+        :param ttl:         time to live of the fragment in seconds (None - until it is evicted)
+        :param content:     lambda function, which renders the fragment
+        """
+        result = SuitRunTime.fragments.get(key)
+        if result is None:
+            mark = SuitRunTime.mark()
+            result = content()
+            # a pass of an asynchronous render with values, which are not awaited yet, is discarded
+            if SuitRunTime.mark() == mark:
+                SuitRunTime.fragments.set(key, result, ttl)
+        return result
+
+    @staticmethod
+    def resolve(awaitable):
+        """
+        Returns the result of an awaitable value of the data
+        Outside of an asynchronous render the awaitable itself is returned, while it is not awaited yet - None
+        """
+        resolver = SuitRunTime.resolver.get()
+        return awaitable if resolver is None else resolver.resolve(awaitable)
+
+    @staticmethod
+    def mark():
+        """ Returns the number of awaitable values, which were not available during the current render so far """
+        resolver = SuitRunTime.resolver.get()
+        return None if resolver is None else resolver.misses
+
+    @staticmethod
+    def decided(mark, condition):
         """
-        return true() if eval(condition) else false()
+        Returns the value of a condition, if it was evaluated without waiting for awaitable values
+        Otherwise the pass of the asynchronous render is stopped, so branches are never evaluated by guess
+        :param mark:        SuitRunTime.mark() made before the condition was evaluated
+        :param condition:   value of the condition
+        """
+        if mark is not None and SuitRunTime.resolver.get().misses != mark:
+            raise AwaitableResolver.Pending()
+        return condition
+
+    @staticmethod
+    async def render(execute, data):
+        """
+        Executes a template asynchronously
+        The template is executed in passes: awaitable values referenced by each pass are awaited concurrently,
+        until a pass references only resolved values. Values of branches, which are not taken, are never awaited.
+        Lists and dicts printed whole and the data of suit.environment are encoded by JsonEncoder, which reports
+        the awaitable values nested in them the same way
+        :param execute:     function(data), which executes the template
+        :param data:        data for template execution
+        :return:            result of template execution
+        """
+        resolver = AwaitableResolver()
+        token = SuitRunTime.resolver.set(resolver)
+        try:
+            while True:
+                try:
+                    result = execute(data)
+                except Exception:
+                    # results of a pass with missing values are discarded, so are the errors caused by them
+                    if not resolver.pending:
+                        raise
+                else:
+                    if not resolver.pending:
+                        return result
+                await resolver.gather()
+        finally:
+            SuitRunTime.resolver.reset(token)
+
+    @staticmethod
+    def escape(value):
+        """
+        Escapes html special characters of a string
+        Markup strings (and strings without special characters) are returned as is
+        :param value:   string
+        :return:        escaped string
+        """
+        if value.__class__ is not str and hasattr(value, "__html__"):
+            return value.__html__()
+        if "&" in value or "<" in value or ">" in value or '"' in value or "'" in value:
+            return escape(value, quote=True)
+        return value
+
+    @staticmethod
+    def operand(value):
+        """
+        Converts the value of a variable into an operand of the condition
+        Numeric strings become numbers and "True"/"False" become booleans, as they did with the textual evaluation
+        :param value:   value of a variable
+        :return:        operand
+        """
+        if isinstance(value, str):
+            if SuitRunTime.number.match(value):
+                return float(value) if "." in value else int(value)
+            return SuitRunTime.literals.get(value, value)
+        return value
+
+    number = re.compile(r"-?\d+(\.\d+)?$")
+    literals = {"True": True, "False": False}
 
     @staticmethod
-    def list(iterationGenerator, iterable):
+    def list_items(iterationGenerator, iterable):
         """
-        Returns the result of an iteration
-        :param iterationGenerator:  lambda function that generates template on each cycle iteration
+        Returns the result of an iteration, each cycle gets both iteration variable and the current item
+        :param iterationGenerator:  lambda function(itervar, item) that generates template on each cycle iteration
         :param iterable:            iterable object
         :return: str:               result of cycle
         """
-        iterable = range(0, len(iterable)) if isinstance(iterable, list) else iterable
-        return "".join([iterationGenerator(itervar) for itervar in iterable])
+        return "".join([iterationGenerator(itervar, item) for itervar, item in SuitRunTime.iterate_items(iterable)])
+
+    @staticmethod
+    def iterate_items(iterable):
+        """
+        Returns pairs of iteration variables and items of a cycle
+        :param iterable:            iterable object
+        :return:                    (index, item) for lists, (key, value) for dicts, (item, item value or None) otherwise
+        """
+        if isinstance(iterable, list):
+            return enumerate(iterable)
+        if isinstance(iterable, dict):
+            return iterable.items()
+        return ((itervar, SuitRunTime.item(iterable, itervar)) for itervar in iterable)
+
+    @staticmethod
+    def item(iterable, itervar):
+        """ Returns the item of an iterable by the iteration variable or None, if there is no such item """
+        try:
+            return iterable[itervar]
+        except (KeyError, IndexError, TypeError):
+            return None
 
     @staticmethod
     def expression(expression):
         """
         Evaluates an expression
+        Compiled code of expressions is kept in SuitRunTime.expressions cache
         :param expression:          expression string
         :return:                    result of evaluation
         """
-        return eval(expression)
+        code = SuitRunTime.expressions.get(expression)
+        if code is None:
+            code = compile(expression, "<expression>", "eval")
+            SuitRunTime.expressions.set(expression, code)
+        return eval(code)
 
     @staticmethod
-    def include(iter_dict, template_name, main_data, datatemplate_part_to_become_data):
-        from copy import deepcopy
-        from collections import OrderedDict
-
-        main_data = main_data()
-        new_data = deepcopy(main_data)
+    def include(iter_dict, template_name, main_data, datatemplate_part_to_become_data, where=None):
+        """
+        Executes an included template
+        Included template gets a scope layered on top of the parent data (iteration variables and include parameters
+        are written into the top layer), so the parent data is neither copied nor modified
+        :param where:   location of the include tag ("template:line:column") for error messages
+        """
+        new_data = ChainMap({}, main_data())
         for key in iter_dict:
             new_data["itervar_%s" % key] = iter_dict[key]
             datatemplate_part_to_become_data = datatemplate_part_to_become_data.replace('[%s]' % key,
                                                                                         '[itervar_%s]' % key)
+        params = Suit(datatemplate_part_to_become_data).execute(new_data)
         try:
-            scope_data = json.loads(Suit(datatemplate_part_to_become_data).execute(new_data),
-                                    object_pairs_hook=OrderedDict)
-            new_data.update(scope_data)
-        except ValueError:
-            print("!!! ERROR !!! INVALID JSON: %s" % Suit(datatemplate_part_to_become_data).execute(new_data))
+            new_data.update(json.loads(params, object_pairs_hook=OrderedDict))
+        except ValueError as err:
+            raise SuitRunTime.parameters_error(template_name, where, params, err)
         return Suit("views.%s" % template_name).execute(new_data)
 
+    @staticmethod
+    def include_scope(template_name, data, params):
+        """
+        Executes an included template with parameters, compiled into a dictionary
+        :param template_name:   name of the included template
+        :param data:            data of the parent template
+        :param params:          parameters of the include, which are layered on top of the parent data
+        :return:                result of the included template execution
+        """
+        return Suit("views.%s" % template_name).execute(ChainMap(params, data))
+
+    @staticmethod
+    def parameter(value, template_name, where=None):
+        """
+        Converts the value of a variable into the value of an include parameter
+        Strings are treated as JSON (as parameters used to be rendered and parsed)
+        :param where:   location of the include tag ("template:line:column") for error messages
+        :raises TemplateParseError: if a string is not valid JSON
+        """
+        if isinstance(value, str):
+            try:
+                return json.loads(value)
+            except ValueError as err:
+                raise SuitRunTime.parameters_error(template_name, where, value, err)
+        return value
+
+    @staticmethod
+    def parameters_error(template_name, where, params, err):
+        """ Returns the error of invalid parameters of an included template """
+        return TemplateParseError("invalid parameters of included template %s%s: %s (%s)" % (
+            template_name, " at %s" % where if where else "", params, err
+        ))
+
+
+class SuitProfiler(object):
+    """
+    Statistics of templates compiled with profiling (Compiler(profile=True) or suitup --profile)
+    For each tag (<list>, <if>, <expression>, <cache>, included template) and each filter it counts calls,
+    wall time and output bytes, keyed by (template name, "tag at line:column"). Time of a tag includes time
+    of the tags nested in it. Templates compiled without profiling have no instrumentation at all
+    """
+
+    stats = {}
+    lock = threading.Lock()
+
+    @staticmethod
+    def measure(key, render):
+        """
+        Renders a tag and records its statistics
+        :param key:     (template name, tag)
+        :param render:  lambda function, which renders the tag
+        :return:        result of the rendering
+        """
+        start = perf_counter()
+        result = render()
+        SuitProfiler.record(key, perf_counter() - start, len(str(result).encode()))
+        return result
+
+    @staticmethod
+    def stream(key, chunks):
+        """
+        Yields chunks of a tag rendered progressively (Suit.render_iter) and records its statistics
+        Only the time of producing the chunks is counted, not the time the consumer spends between them
+        :param key:     (template name, tag)
+        :param chunks:  generator of the chunks of the tag
+        """
+        elapsed, size = 0.0, 0
+        try:
+            start = perf_counter()
+            for chunk in chunks:
+                elapsed += perf_counter() - start
+                size += len(str(chunk).encode())
+                yield chunk
+                start = perf_counter()
+            elapsed += perf_counter() - start
+        finally:
+            SuitProfiler.record(key, elapsed, size)
+
+    @staticmethod
+    def wrap(key, function):
+        """ Returns the function (of a filter), which records statistics of its calls """
+        def measured(*args):
+            start = perf_counter()
+            result = function(*args)
+            SuitProfiler.record(key, perf_counter() - start, len(str(result).encode()))
+            return result
+        return measured
+
+    @staticmethod
+    def record(key, elapsed, size):
+        """ Adds a call (its time and the number of output bytes) to the statistics of the key """
+        with SuitProfiler.lock:
+            entry = SuitProfiler.stats.get(key)
+            if entry is None:
+                entry = SuitProfiler.stats[key] = [0, 0.0, 0]
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] += size
+
+    @staticmethod
+    def report(top=10, order="time"):
+        """
+        Returns hot spots of the templates
+        :param top:     number of hot spots (None - all of them)
+        :param order:   "time", "calls" or "bytes"
+        :return: list:  [{"template", "tag", "calls", "time", "bytes"}], the hottest first
+        """
+        with SuitProfiler.lock:
+            report = [
+                {"template": template, "tag": tag, "calls": calls, "time": elapsed, "bytes": size}
+                for (template, tag), (calls, elapsed, size) in SuitProfiler.stats.items()
+            ]
+        report.sort(key=lambda item: item[order], reverse=True)
+        return report[:top] if top is not None else report
+
+    @staticmethod
+    def reset():
+        """ Removes collected statistics """
+        with SuitProfiler.lock:
+            SuitProfiler.stats.clear()
+
+
+class FilterEntry(namedtuple("FilterEntry", "function js pure")):
+    """ Registered filter: python function, source of the javascript function (or None) and purity flag """
+    __slots__ = ()
+
 
 class SuitFilters(object):
     """
     Базовый класс, предоставляющий функционал фильтров (декораторов) для применения к переменным
 
+    Собственные фильтры регистрируются через SuitFilters.register:
+
+        @SuitFilters.register("slugify", js="function(value) { return value.toLowerCase(); }", pure=True)
+        def slugify(value):
+            return value.lower()
+
     """
 
+    registry = {}
+
+    @staticmethod
+    def register(name, function=None, js=None, pure=False):
+        """
+        Registers the filter (may be used as a decorator)
+        Filters are bound to the compiled templates when they are imported, so register them before rendering
+
+        :param name:        name of the filter
+        :param function:    python function(var) or function(var, data)
+        :param js:          source of the javascript function(var, data), if the filter is used on the client side
+        :param pure:        the result depends on the arguments only, so it is memoized within a render
+        """
+        if function is None:
+            return lambda function: SuitFilters.register(name, function, js, pure)
+        SuitFilters.registry[name] = FilterEntry(function, js, pure)
+        return function
+
+    @staticmethod
+    def get(name):
+        """ Returns the function of the filter (the registered one or the built-in) """
+        entry = SuitFilters.registry.get(name)
+        if entry is not None:
+            return SuitFilters.memoized(name, entry.function) if entry.pure else entry.function
+        function = getattr(SuitFilters, "_" + name, None)
+        if function is None:
+            def function(*args):
+                raise AttributeError("unknown filter: %s" % name)
+        return function
+
+    @staticmethod
+    def is_pure(name):
+        """ Checks if the filter result depends on its arguments only (built-in filters are pure) """
+        entry = SuitFilters.registry.get(name)
+        return entry.pure if entry is not None else hasattr(SuitFilters, "_" + name)
+
+    @staticmethod
+    def memoized(name, function):
+        """ Wraps the function of a pure filter, so its results are cached within a render """
+        def wrapper(*args):
+            rendered = SuitRunTime.rendered.get()
+            if rendered is None:
+                return function(*args)
+            key = (name,) + tuple((arg.__class__, arg) for arg in args)
+            try:
+                return rendered[key]
+            except KeyError:
+                result = rendered[key] = function(*args)
+                return result
+            except TypeError:
+                return function(*args)
+        return wrapper
+
     @staticmethod
     def _length(var):
         if var is True:
@@ -1135,9 +2929,15 @@ class SuitFilters(object):
                 data = json.loads(data)
             except:
                 data = data or []
-        if not isinstance(data, (dict, list, tuple)):
+        if not isinstance(data, (dict, list, tuple, frozenset, set)):
+            return False
+        if isinstance(var, SuitNone) or isinstance(data, SuitNone):
+            return False
+        try:
+            return var in data
+        except TypeError:
+            # unhashable values are never contained in sets of literals
             return False
-        return (var in data) if (isinstance(var, SuitNone) is False and isinstance(data, SuitNone) is False) else False
 
     @staticmethod
     def _notin(var, data):
@@ -1166,11 +2966,17 @@ class SuitFilters(object):
             return var.strftime(format_str)
         elif isinstance(var, str):
             try:
-                return datetime.strptime(var, '%a %b %d %H:%M:%S %Y').strftime(format_str)
+                return SuitFilters.parse_date(var).strftime(format_str)
             except ValueError:
                 return var
         return var
 
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def parse_date(var):
+        """ Parses dates of json data (see json_dumps_handler), results are cached """
+        return datetime.strptime(var, '%a %b %d %H:%M:%S %Y')
+
     @staticmethod
     def _str(var):
         return '''"%s"''' % var
@@ -1181,7 +2987,7 @@ class SuitFilters(object):
 
     @staticmethod
     def _html(var):
-        return unescape(var)
+        return var if hasattr(var, "__html__") else unescape(var)
 
     @staticmethod
     def _plural_form(initial_num, words):
@@ -1191,7 +2997,7 @@ class SuitFilters(object):
     @staticmethod
     def _plural_word(initial_num, words):
         initial_num = initial_num if initial_num else 0
-        if words:
+        if isinstance(words, str):
             words = json.loads(words)
         num = int(initial_num) % 100
         if num > 19:
@@ -1259,6 +3065,8 @@ def json_dumps_handler(obj):
         return obj.ctime()
     if isinstance(obj, datetime) or isinstance(obj, date):
         return obj.ctime()
+    if isinstance(obj, Mapping):
+        return dict(obj)
     return None
 
 
@@ -1282,21 +3090,13 @@ def json_safedumps(content):
     var data = JSON.parse("{{ encoded_data }}");
     </script>
     So, quotes in the JSON needed to be escaped to not conflict with the string delimiters, newlines had to be removed or they'd cause a JavaScript syntax error, and so-on.
-    - - -
-    Originally, the two __literal_slash__ lines didn't exist, and it would fall apart if some of the text had a literal "\n" sequence written out in text, i.e. "\\n", as in this example:
-    >>> data = {"message": "Hello\\nworld!"}
-    >>> json.dumps(data)
-    {"message": "Hello\\nworld!"}
-    What would happen was that the "\\n" substitution would end up matching the "\n" from "\\n" and removing it, leaving an orphaned, single "\" character behind. If that character then ended up touching another letter and it didn't form a valid JSON escape sequence (for example, "\a"), this would cause a JSON parse error in the JavaScript.
-    So, they first rename literal \ characters to __literal_slash__, do all the other substitutions, and then rename it back.
+    String literals are escaped by the encoder as they are encoded (see JavascriptLiteralEncoder): backslashes and
+    double quotes are escaped once more, single quotes are escaped, newlines are removed. A literal "\\n" sequence
+    written out in text stays an escaped backslash followed by "n":
+    >>> print(json_safedumps({"message": "Hello\\\\nworld!"}))
+    {"message": "Hello\\\\\\\\nworld!"}
     """
-    return json.dumps(content, default=json_dumps_handler) \
-        .replace('\\\\', '__literal_slash__') \
-        .replace('\\n', '') \
-        .replace('\\r', '') \
-        .replace('\\"', '\\\\"') \
-        .replace("'", "\\'") \
-        .replace('__literal_slash__', '\\\\\\\\')
+    return SuitRunTime.encoder.safedumps(content)
 
 
 def trimSpaces(string):
@@ -3,6 +3,7 @@
 
 """
 
+import asyncio
 import unittest
 import os
 import re
@@ -11,9 +12,15 @@ import json
 import subprocess
 
 from datetime import datetime, date, time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.util import setup_testing_defaults
+from wsgiref.validate import validator
 
 
 from suit.Suit import XmlTag, PythonSyntax, JavascriptSyntax, Compiler, Suit, suit, trimSpaces, json_dumps_handler
+from suit.Suit import Tokenizer, TemplateParseError, TemplatePart, ListNode, ConditionNode, SuitRunTime, buildTree
+from suit.Suit import LRUCache, FragmentCache, SuitNone, Markup, JsonEncoder, JavascriptLiteralEncoder, json_safedumps
+from suit.Suit import TemplateLoader, TemplateNotFound, ConstantFolder, SuitProfiler
 
 
 # Получаем результат выполнения скомпилированного js кода
@@ -106,6 +113,8 @@ class SuitTest(unittest.TestCase):
 
         # Получам результат выполнения скомпилированного python кода
         executed_python = Suit("views.subfolder.%s" % fileName).execute(data)
+        # Потоковое выполнение должно давать тот же результат
+        self.assertEqual(executed_python, "".join(Suit("views.subfolder.%s" % fileName).render_iter(data, encoding=None)))
         executed_python = filterForExecuted(executed_python) if filterForExecuted is not None else executed_python
 
         # Получаем скомпилированный js код
@@ -208,6 +217,51 @@ class SuitTest(unittest.TestCase):
                         </tagName>''')
         self.assertEqual("<p>content</p><p>content</p>", tag.body)
 
+    def test_tokenizer(self):
+        """ Проверим разбор шаблона в дерево тегов за один проход """
+        parts = Tokenizer().parse(
+            '''a<if condition="<var>x</var> > 1"><true><var d='<var>y</var>'>z</var></true></if>b'''
+        )
+        self.assertEqual("a", parts[0])
+        self.assertEqual("b", parts[2])
+        self.assertEqual("if", parts[1].name)
+        self.assertEqual('''<if condition="<var>x</var> > 1">''', parts[1].head)
+        self.assertEqual(["true"], [node.name for node in parts[1].children()])
+
+        var = parts[1].children()[0].children()[0]
+        self.assertEqual("var", var.name)
+        self.assertEqual("z", var.body_source())
+        self.assertEqual('''<var d='<var>y</var>'>z</var>''', var.source())
+
+        # Несовпадающие открывающие и закрывающие теги
+        self.assertRaises(TemplateParseError, Tokenizer().parse, "<if><var>a</if></var>")
+        self.assertRaises(TemplateParseError, Tokenizer().parse, "<if>a")
+
+    def test_list_item_binding(self):
+        """ Переменные цикла разрешаются от текущего элемента цикла, а не от корня данных """
+        template = '''<list for="u" in="users"><var>u.name</var>:<list for="c" in="u.tags"><var>c</var><var>u.id</var>,</list>;</list>'''
+        compiled = PythonSyntax().compile(buildTree(template))
+        self.assertNotIn("_context, None, u", compiled)
+        self.assertIn("_path0(_item_u, None)", compiled)
+        self.simulate(template, "a:x1,y1,;b:;c:;", {"users": [
+            {"name": "a", "id": 1, "tags": ["x", "y"]}, {"name": "b", "id": 2, "tags": []}, {"name": "c"}
+        ]})
+        self.simulate('''<list for="k, v" in="d"><var>k</var>=<var>v.x</var>;</list>''', "a=1;b=2;",
+                      {"d": {"a": {"x": 1}, "b": {"x": 2}}})
+
+    def test_template_tree(self):
+        """ Дерево шаблона строится один раз и используется всеми языковыми движками """
+        template_part = TemplatePart('''<list for="a" in="items"><if condition="<var>a</var> > 1"><var>a</var></if></list>''')
+        tree = template_part.getTree()
+        self.assertIs(tree, template_part.getTree())
+        self.assertEqual("{{ph:0}}", tree.text)
+        self.assertIsInstance(tree.tags[0], ListNode)
+        self.assertIsInstance(tree.tags[0].template.tags[0], ConditionNode)
+        self.assertRaises(AttributeError, setattr, tree, "text", "")
+
+        self.assertTrue(PythonSyntax().compile(tree).startswith('"%s" % (SuitRunTime.list_items(lambda a, _item_a: '))
+        self.assertTrue(JavascriptSyntax().compile(tree).startswith('"{0}".format(suit.SuitRunTime.list(function(a)'))
+
     def test_spaceTrimmer(self):
         """
         Проверим, что множественные пробелы или табуляция заменяются на один пробел
@@ -244,6 +298,35 @@ class SuitTest(unittest.TestCase):
         # self.simulate("<var>a</var>", '''[1,null,3,"",false,"True"]''', {"a": [1, None, 3, "", False, "True"]},
         #               filterForExecuted=lambda m: m.replace(" ", ""))
 
+    def test_json_encoder(self):
+        """
+        Проверим подключаемый json-кодировщик: списки и словари кодируются один раз за выполнение шаблона,
+        json_safedumps выдает безопасную для javascript-литерала строку
+
+        """
+        class CountingEncoder(JsonEncoder):
+            calls = 0
+
+            def dumps(self, obj):
+                CountingEncoder.calls += 1
+                return super().dumps(obj)
+
+        self.simulate('''<list for="i" in="rows"><var>items</var></list>''', "[1][1]", {"rows": [1, 2], "items": [1]},
+                      name="encoded")
+        encoder, SuitRunTime.encoder = SuitRunTime.encoder, CountingEncoder()
+        try:
+            self.assertEqual("[1][1][1]", Suit("views.subfolder.encoded").execute({"rows": [1, 2, 3], "items": [1]}))
+            self.assertEqual(1, CountingEncoder.calls)
+        finally:
+            SuitRunTime.encoder = encoder
+
+        self.assertEqual(r'''{"a": "it\'s \\"q\\" \\\\n"}''', json_safedumps({"a": "it's \"q\" \\n\n"}))
+        # строки экранируются самим кодировщиком, в том числе ключи и строки вложенных структур
+        data = {"k'\r": ["\\", "ё", {"d": date(2020, 1, 2)}]}
+        expected = r'''{"k\'": ["\\\\", "\u0451", {"d": "Thu Jan  2 00:00:00 2020"}]}'''
+        self.assertEqual(expected, json_safedumps(data))
+        self.assertEqual(expected, "".join(JavascriptLiteralEncoder(default=json_dumps_handler).iterencode(data)))
+
     def test_safevaraccess(self):
         """
         Проверим простой вывод значения переменной
@@ -274,6 +357,27 @@ class SuitTest(unittest.TestCase):
         self.simulate("<var>classRoom.person.studentName</var>", "SuitNone()", data, filterForExecuted=self.unifyNone)
         self.simulate("<var d='Vladimir'>classRoom.person.studentName</var>", "Vladimir", data)
 
+    def test_accessor(self):
+        """
+        Доступ к переменным через функции, скомпилированные для каждого пути
+
+        """
+        access = SuitRunTime.accessor(("rows", None, "name"))
+        self.assertIs(access, SuitRunTime.accessor(("rows", None, "name")))
+        data = {"rows": [{"name": "<b>"}, {"name": None}, 5]}
+        self.assertEqual("&lt;b&gt;", access(data, None, 0))
+        self.assertEqual("default", access(data, "default", 1))
+        self.assertIsInstance(access(data, None, 2), SuitNone)
+        self.assertIsInstance(access(data, None, 3), SuitNone)
+        self.assertIsInstance(access({"rows": "abc"}, None, "x"), SuitNone)
+        self.assertEqual("b", SuitRunTime.accessor(("rows", -1))({"rows": "ab"}, None))
+
+        syntax = PythonSyntax()
+        self.assertEqual("_path0(_context, None)", syntax.var('["a"][0]["b"]', without_stringify=True))
+        self.assertEqual({"SuitRunTime.accessor(('a', 0, 'b'))": "_path0"}, syntax.definitions)
+        # переменные вне циклов компилируются как и прежде
+        self.assertTrue(syntax.var('["a"][b]', without_stringify=True).startswith("SuitRunTime.var(lambda _context"))
+
     def test_listPointers(self):
         """
         Проверим синтаксис обращения к элементам списков
@@ -456,6 +560,20 @@ class SuitTest(unittest.TestCase):
         self.simulate(template, "Да", {"propertyName": " "})
         self.simulate(template, "Нет", {"propertyName": "qwerty"})
 
+        # json-строка разбирается при компиляции
+        syntax = PythonSyntax()
+        compiled = syntax.compile(buildTree('''<var filter='in' in-data='["Y", " "]'>propertyName</var>'''))
+        self.assertIn("_filter2(_path0(_context, None), _data1)", compiled)
+        self.assertIn('''_data1 = frozenset(['Y', ' '])''', syntax.definitions_source())
+        self.assertIn('''["Y", " "]''', JavascriptSyntax().compile(buildTree('''<var filter='in' in-data='["Y", " "]'>a</var>''')))
+
+    def test_filter_plural_form(self):
+        """ Фильтр plural_form с данными, разобранными при компиляции """
+        template = '''<var filter="plural_form" plural_form-data='["яблоко", "яблока", "яблок"]'>n</var>'''
+        self.simulate(template, "21 яблоко", {"n": 21})
+        self.simulate(template, "3 яблока", {"n": 3})
+        self.simulate(template, "11 яблок", {"n": 11})
+
     def test_filter_notin(self):
         """
         Фильтр notin:
@@ -518,6 +636,50 @@ class SuitTest(unittest.TestCase):
         """ Проверим фильтр для замены переводов строк на <br /> """
         self.simulate("<var filter='usebr'>text</var>", "123<br />456", {"text": "123\n456"})
 
+    def test_filter_html(self):
+        """ Проверим фильтр html и строки, помеченные как безопасные (Markup) """
+        self.simulate("<var filter='html'>text</var>|<var>text</var>", "<br>&amp;|&lt;br&gt;&amp;amp;",
+                      {"text": "<br>&amp;"})
+        self.assertEqual("{<b>bold</b>}", Suit("{<var>list[0]</var>}").execute({"list": [Markup("<b>bold</b>")]}))
+        self.assertNotIn("_html", PythonSyntax().compile(buildTree("<var filter='html'>text</var>")))
+
+        clean = "no special characters"
+        self.assertIs(clean, SuitRunTime.escape(clean))
+        self.assertEqual("&lt;&amp;&quot;&#x27;&gt;", SuitRunTime.escape("<&\"'>"))
+        self.assertEqual("<&>", SuitRunTime.escape(Markup("<&>")))
+
+    def test_filter_custom(self):
+        """ Собственные фильтры, зарегистрированные в SuitFilters.register """
+        from suit.Suit import SuitFilters
+        calls = []
+
+        @SuitFilters.register("shout", js="function(value, data) { return value.toUpperCase() + data; }", pure=True)
+        def shout(value, data):
+            calls.append(value)
+            return value.upper() + data
+
+        try:
+            self.simulate("<var filter='shout' shout-data='!'>a</var>", "HI!", {"a": "hi"})
+
+            # чистый фильтр вычисляется однократно за рендер
+            del calls[:]
+            template = "{<var filter='shout' shout-data='!'>a</var>-<var filter='shout' shout-data='!'>a</var>}"
+            self.assertEqual("{HI!-HI!}", Suit(template).execute({"a": "hi"}))
+            self.assertEqual(["hi"], calls)
+
+            # фильтры связываются с именами уровня модуля
+            syntax = PythonSyntax()
+            compiled = syntax.compile(buildTree("<var filter='shout' shout-data='?'>a</var>"))
+            self.assertNotIn("SuitFilters", compiled)
+            self.assertIn("SuitFilters.get('shout')", syntax.definitions_source())
+
+            # несколько фильтров применяются по порядку, каждый со своими данными
+            self.simulate("<var filter='shout,length' shout-data='!!'>a</var>", "4", {"a": "ab"})
+            self.assertTrue(SuitFilters.is_pure("length"))
+            self.assertFalse(SuitFilters.is_pure("unknown"))
+        finally:
+            del SuitFilters.registry["shout"]
+
     # # # ################################ Conditions ###################################
 
     def test_сonditions(self):
@@ -650,8 +812,89 @@ class SuitTest(unittest.TestCase):
         self.simulate(template, "Нет", {"isOk": None, "value": 3})
         self.simulate(template, "Нет", {})
 
+    def test_condition_native(self):
+        """
+        Проверим условия, которые компилируются в нативный код python:
+        переменные внутри строковых литералов и ключевые слова в путях до переменных
+
+        """
+        template = '''
+        <if>
+        <condition>"<var>kind</var>-x" == "a-x" && <var>flags.true_flag</var> == true</condition>
+        <true>Да</true>
+        <false>Нет</false>
+        </if>
+        '''
+        self.simulate(template, "Да", {"kind": "a", "flags": {"true_flag": True}})
+        self.simulate(template, "Нет", {"kind": "b", "flags": {"true_flag": True}})
+        self.simulate(template, "Нет", {"kind": "a", "flags": {"true_flag": False}})
+
+        syntax = PythonSyntax()
+        code = syntax.compile_condition(buildTree("<var>a</var> > 1.5"))
+        self.assertNotIn("eval", code)
+        self.assertEqual(True, eval(code, dict(syntax.definitions_namespace(), SuitRunTime=SuitRunTime, _context={"a": "2"})))
+        self.assertRaises(TemplateParseError, PythonSyntax().compile_condition, buildTree("<var>a</var> >"))
+
     # #################################### Lists ###################################
 
+    def test_render_iter(self):
+        """
+        Проверим потоковое выполнение шаблона: статический текст и строки цикла отдаются по мере готовности
+
+        """
+        template = '''<!DOCTYPE html><html><head><var>title</var></head><body><list for="row" in="rows"><p><var>row</var></p></list></body></html>'''
+        self.simulate(template, '''<!DOCTYPE html><html><head>t</head><body><p>1</p><p>2</p></body></html>''', {"rows": [1, 2], "title": "t"},
+                      name="streamed")
+        chunks = Suit("views.subfolder.streamed").render_iter({"rows": list(range(1000)), "title": "t"}, buffer_size=1)
+        self.assertEqual(b"<!DOCTYPE html><html><head>t</head><body>", next(chunks))
+        self.assertEqual([b"<p>", b"0", b"</p>", b"<p>", b"1"], [next(chunks) for i in range(5)])
+        self.assertEqual(1000, b"".join(chunks).count(b"<p>") + 2)
+
+        # мелкие части результата собираются в блоки не меньше buffer_size символов
+        data = {"rows": ["ё" * (i % 3) for i in range(1000)], "title": "t"}
+        chunks = list(Suit("views.subfolder.streamed").render_iter(data, buffer_size=1024))
+        self.assertEqual(Suit("views.subfolder.streamed").execute(data).encode(), b"".join(chunks))
+        self.assertTrue(all(isinstance(chunk, bytes) for chunk in chunks))
+        self.assertTrue(all(1024 <= len(chunk.decode()) < 1024 + 16 for chunk in chunks[:-1]))
+        self.assertEqual(["<!DOCTYPE html><html><head>t</head><body><p></p><p>ё</p></body></html>"],
+                         list(Suit("views.subfolder.streamed").render_iter({"rows": ["", "ё"], "title": "t"}, encoding=None)))
+
+        # результат - итерируемый объект WSGI
+        def application(environ, start_response):
+            start_response("200 OK", [("Content-Type", "text/html; charset=utf-8")])
+            return Suit("views.subfolder.streamed").render_iter({"rows": [1, 2], "title": "t"})
+        environ = {}
+        setup_testing_defaults(environ)
+        response = validator(application)(environ, lambda status, headers: None)
+        try:
+            self.assertEqual(b"<!DOCTYPE html><html><head>t</head><body><p>1</p><p>2</p></body></html>", b"".join(response))
+        finally:
+            response.close()
+
+        # suit.environment добавляется и при потоковом выполнении:
+        data = {"rows": [1], "title": "auto-refresh"}
+        self.assertIn("suit_environment_script", Suit("views.subfolder.streamed").execute(data))
+        self.assertEqual(Suit("views.subfolder.streamed").execute(data),
+                         "".join(Suit("views.subfolder.streamed").render_iter(data, encoding=None)))
+
+        # списки кодируются один раз за выполнение и при потоковом выполнении
+        self.simulate('''<var>rows</var>|<var>rows</var>''', "[1,2]|[1,2]", {"rows": [1, 2]}, name="streamed_twice",
+                      filterForExecuted=lambda result: result.replace(" ", ""))
+        encoder, dumps = SuitRunTime.encoder, []
+
+        class CountingEncoder(object):
+            def dumps(self, obj):
+                dumps.append(obj)
+                return encoder.dumps(obj)
+
+        SuitRunTime.encoder = CountingEncoder()
+        try:
+            self.assertEqual(b"[1, 2]|[1, 2]", b"".join(Suit("views.subfolder.streamed_twice").render_iter({"rows": [1, 2]})))
+        finally:
+            SuitRunTime.encoder = encoder
+        self.assertEqual(1, len(dumps))
+        self.assertIsNone(SuitRunTime.rendered.get())
+
     def test_list(self):
         """
         Простой список.
@@ -881,6 +1124,44 @@ class SuitTest(unittest.TestCase):
         self.simulate("<expression>1 + 3</expression>", "4")
         self.simulate("<expression>1 + <var>someVar</var></expression>", "4", {"someVar": "3"})
 
+    def test_expression_cache(self):
+        """
+        Выражения компилируются в нативный код (переменные подставляются как значения),
+        а выражения с именами кешируются в виде скомпилированного кода
+
+        """
+        self.assertEqual("(2 * 3)", PythonSyntax().compile_expression(buildTree("2 * 3")))
+        self.assertRaises(TemplateParseError, PythonSyntax().compile_expression, buildTree("2 *"))
+
+        syntax = PythonSyntax()
+        code = syntax.compile_expression(buildTree("<var>a</var> * (<var>b</var> + 1) - len('<var>c</var>')"))
+        self.assertIn("SuitRunTime.expression", code)
+        code = syntax.compile_expression(buildTree("<var>a</var> * (<var>b</var> + 1) + 0.5"))
+        self.assertNotIn("SuitRunTime.expression", code)
+        namespace = dict(syntax.definitions_namespace(), SuitRunTime=SuitRunTime, _context={"a": "3", "b": 2})
+        self.assertEqual(9.5, eval(code, namespace))
+        code = syntax.compile_expression(buildTree("'<var>a</var>-' + '<var>b</var>'"))
+        self.assertNotIn("SuitRunTime.expression", code)
+        self.assertEqual("3-2", eval(code, namespace))
+        self.simulate("<expression><var>a</var> * (<var>b</var> + 1)</expression>", "9", {"a": "3", "b": 2})
+        self.simulate('''<list for="r" in="rows"><expression><var>r.n</var> * 2 + <var>k</var></expression>,</list>''', "3,5,",
+                      {"rows": [{"n": 1}, {"n": "2"}], "k": 1})
+
+        SuitRunTime.expressions.clear()
+        self.assertEqual(5, SuitRunTime.expression("2 + 3"))
+        self.assertEqual(5, SuitRunTime.expression("2 + 3"))
+        self.assertEqual({"hits": 1, "misses": 1, "evictions": 0, "size": 1, "maxsize": 1024},
+                         SuitRunTime.expressions.stats())
+
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(None, cache.get("b"))
+        self.assertEqual([1, 3], [cache.get("a"), cache.get("c")])
+        self.assertEqual(1, cache.evictions)
+
     #################################### Embedded CSS ###################################
     def test_embeddedCSS(self):
         """
@@ -1178,6 +1459,14 @@ class SuitTest(unittest.TestCase):
         self.simulate(template3, "a=2: 1-2-3", {"a": 2})
         self.simulate(template3, "a=4: 1-4-3", {"a": 4})
 
+    def test_inline_cache(self):
+        """ Встроенные шаблоны (параметры включаемых шаблонов) компилируются один раз """
+        Suit.inline.clear()
+        template = '''{"a": <var>a</var>, "b": "<var>b</var>"}'''
+        self.assertEqual('''{"a": 1, "b": "x"}''', Suit(template).execute({"a": 1, "b": "x"}))
+        self.assertEqual('''{"a": 2, "b": "SuitNone()"}''', Suit(template).execute({"a": 2}))
+        self.assertEqual({"hits": 1, "misses": 1, "evictions": 0, "size": 1, "maxsize": 512}, Suit.inline.stats())
+
     def test_breakPoint_include_with_params_in_list(self):
         """ Тестируем включение шаблонов и передачу в них параметров из переменных цикла """
         inc_template = '''-<var>a</var>-'''
@@ -1192,6 +1481,242 @@ class SuitTest(unittest.TestCase):
         self.simulate(list_template1, "-1--1-", {"users": ["Andrey", "Nikolay"], "a": 1})
         self.simulate(list_template2, "-Andrey--Nikolay-", {"users": ["Andrey", "Nikolay"], "a": 1})
 
+    def test_concurrent_execution(self):
+        """ Один объект шаблона выполняется одновременно из нескольких потоков """
+        self.simulate('''<var>title</var>:<var>n</var>''', "t:1", {"title": "t", "n": 1}, name="concurrent_inc")
+        template = '''<var>title</var>|<list for="row" in="rows"><var>row.n</var><if condition="<var>row.n</var> > 1">+</if>,</list>|<breakpoint include="subfolder.concurrent_inc">{"n": <var>n</var>}</breakpoint>'''
+        self.simulate(template, "a|1,2+,|a:3", {"title": "a", "n": 3, "rows": [{"n": 1}, {"n": 2}]}, name="concurrent")
+
+        shared = Suit("views.subfolder.concurrent")
+        inline = Suit("{<var>title</var>-<var>n</var>}")
+
+        def render(i):
+            data = {"title": "t%d" % i, "n": i, "rows": [{"n": n} for n in range(i % 5)]}
+            rows = "".join(["%d%s," % (n, "+" if n > 1 else "") for n in range(i % 5)])
+            self.assertEqual("t%d|%s|t%d:%d" % (i, rows, i, i), shared.execute(data))
+            self.assertEqual("{t%d-%d}" % (i, i), inline.execute(data))
+            self.assertEqual(shared.execute(data), b"".join(shared.render_iter(data)).decode())
+            return i
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            self.assertEqual(list(range(2000)), list(pool.map(render, range(2000))))
+
+    def test_render_async(self):
+        """ Асинхронное выполнение: awaitable-значения данных ожидаются при обращении, конкурентно """
+        template = '''<var>user.name</var>|<if condition="<var>admin</var>"><true><var>secret</var></true><false><var>public</var></false></if>|<list for="w" in="widgets"><var>w.title</var>,</list>'''
+        self.simulate(template, "A|p|x,y,", {
+            "user": {"name": "A"}, "admin": False, "secret": "s", "public": "p", "widgets": [{"title": "x"}, {"title": "y"}]
+        }, name="render_async")
+        awaited, running = [], []
+
+        async def value(name, result):
+            awaited.append(name)
+            running.append(name)
+            await asyncio.sleep(0.01)
+            concurrency.append(len(running))
+            running.remove(name)
+            return result
+
+        def render(target):
+            data = {
+                "user": value("user", {"name": "A"}), "admin": value("admin", False),
+                "secret": value("secret", "s"), "public": value("public", "p"),
+                "widgets": [value("x", {"title": "x"}), value("y", {"title": "y"})]
+            }
+            try:
+                return asyncio.run(target.render(data))
+            finally:
+                for coroutine in [data["user"], data["admin"], data["secret"], data["public"]] + data["widgets"]:
+                    coroutine.close()
+
+        concurrency = []
+        self.assertEqual("A|p|x,y,", render(Suit("views.subfolder.render_async")))
+        # значения ветки, которая не выбрана, не ожидаются
+        self.assertNotIn("secret", awaited)
+        self.assertEqual({"user", "admin", "public", "x", "y"}, set(awaited))
+        self.assertGreater(max(concurrency), 1)
+
+        self.assertEqual("A|p|x,y,", render(Suit.load("views.subfolder.render_async")()))
+        self.assertEqual("{A}", render(Suit("{<var>user.name</var>}")))
+        self.assertEqual("A", Suit("views.subfolder.render_async").execute({"user": {"name": "A"}}).split("|")[0])
+
+        # awaitable-значения внутри списков и словарей, выводимых целиком, и в данных suit.environment
+        template = '''<!DOCTYPE html><html><head><var>title</var></head><body><var>tags</var>|<var>obj</var></body></html>'''
+        plain = {"title": "auto-refresh", "tags": ["u&v", "u&v"], "obj": {"name": "abc", "n": 1}, "users": ["a"]}
+        self.simulate(template, '''<!DOCTYPE html><html><head>auto-refresh</head><body>["u&v", "u&v"]|{"name": "abc", "n": 1}</body></html>''',
+                      plain, name="render_async_nested",
+                      filterForExecuted=lambda res: re.sub('<script id="suit_environment_script">.*?</script>| ', "", res))
+        coroutines = []
+
+        def awaitable(result):
+            async def resolved():
+                return result
+            coroutines.append(resolved())
+            return coroutines[-1]
+
+        data = {
+            "title": awaitable("auto-refresh"), "tags": [awaitable("u&v"), awaitable("u&v")],
+            "obj": {"name": awaitable("abc"), "n": 1}, "users": awaitable(["a"])
+        }
+        try:
+            result = asyncio.run(Suit("views.subfolder.render_async_nested").render(data))
+        finally:
+            for coroutine in coroutines:
+                coroutine.close()
+        self.assertEqual(Suit("views.subfolder.render_async_nested").execute(plain), result)
+        self.assertIn('''window.suit_environment='{"title": "auto-refresh", "tags": ["u&v", "u&v"], "obj": {"name": "abc", "n": 1}, "users": ["a"]}\'''', result)
+
+    def test_cache_tag(self):
+        """ Тег <cache> сохраняет результат фрагмента между выполнениями шаблона """
+        template = '''<cache key="test_cache_tag-<var>lang</var>" ttl="60"><list for="i" in="items"><var>i</var></list></cache>!'''
+        self.simulate(template, "12!", {"lang": "ru", "items": [1, 2]}, name="cache_tag")
+
+        stats = SuitRunTime.fragments.stats()
+        # результат берется из кеша, пока ключ не изменится
+        self.assertEqual("12!", Suit("views.subfolder.cache_tag").execute({"lang": "ru", "items": [3]}))
+        self.assertEqual("3!", Suit("views.subfolder.cache_tag").execute({"lang": "en", "items": [3]}))
+        self.assertEqual(stats["hits"] + 1, SuitRunTime.fragments.stats()["hits"])
+
+        self.assertEqual(2, SuitRunTime.fragments.invalidate("test_cache_tag-"))
+        self.assertEqual("4!", Suit("views.subfolder.cache_tag").execute({"lang": "ru", "items": [4]}))
+        self.assertRaises(TemplateParseError, buildTree, "<cache>body</cache>")
+
+    def test_fragment_cache(self):
+        """ Хранилище фрагментов: вытеснение по размеру и по времени жизни """
+        now = [0]
+        cache = FragmentCache(maxsize=2, clock=lambda: now[0])
+        cache.set("a", "A", ttl=10)
+        cache.set("b", "B")
+        self.assertEqual("A", cache.get("a"))
+        cache.set("c", "C")
+        self.assertIsNone(cache.get("b"))
+        now[0] = 10
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual("C", cache.get("c"))
+        self.assertEqual({"hits": 2, "misses": 2, "evictions": 1, "expirations": 1, "size": 1, "maxsize": 2},
+                         cache.stats())
+
+    def test_constant_folding(self):
+        """ Узлы, не зависящие от данных, вычисляются при компиляции """
+        template = '''<if condition="1 > 2"><true>a</true><false>b</false></if><expression>2 * (3 - 1)</expression>|<list for="w" in='["x", "yy"]'><var>w</var>,</list>|<var>name</var>'''
+        folder = ConstantFolder()
+        tree = folder.fold(buildTree(template))
+        self.assertEqual("b4|{{ph:0}}|{{ph:1}}", tree.text)
+        self.assertEqual(2, folder.folded)
+        self.assertNotIn("SuitRunTime.decided", PythonSyntax().compile(tree))
+
+        # свернутое дерево компилируется для всех языков и дает тот же результат, что и без свертки
+        self.simulate(template, "b4||n", {"name": "n"}, name="folded")
+        self.assertEqual(2, self.c.folded)
+        with open("views/__js__/subfolder_folded.js") as f:
+            self.assertNotIn("SuitRunTime.opt(", f.read())
+
+        # код, который python и javascript вычисляют по-разному, не сворачивается
+        for code in ("10/2", "'1' == 1", "3 > 2 > 1", "1 and 2", "not 0", "True", "2 ** 60 + 1", "-7 % 3", "1.5 + 1"):
+            tree = ConstantFolder().fold(buildTree('''<if condition="%s">y</if><expression>%s</expression>''' % (code, code)))
+            self.assertEqual("{{ph:0}}{{ph:1}}", tree.text)
+        self.simulate('''<expression>2 - 3</expression>|<if condition="-1 < 0">y</if>|<if condition="2 == 3">eq</if>''', "-1|y|")
+
+        # узлы, зависящие от элемента цикла, не сворачиваются
+        tree = ConstantFolder().fold(buildTree('''<list for="w" in="items"><if condition="<var>w</var> > 1">+</if></list>'''))
+        self.assertIsInstance(tree.tags[0].template.tags[0], ConditionNode)
+
+    def test_profiler(self):
+        """ Профилирование тегов и фильтров шаблонов, скомпилированных с профилированием """
+        template = '''<list for="row" in="rows">
+            <if condition="<var>row</var> > 1"><var filter="int">row</var></if>
+        </list>'''
+        self.simulate(template, "23", {"rows": [1, 2, 3]}, name="profiled")
+        # строки считаются по исходному файлу: вырезанный <style> и наследование их не сдвигают
+        self.simulate('''<style>
+            p { color: red; }
+        </style>
+        <p>
+            <if condition="<var>a</var>">x</if>
+        </p>''', "<p>x</p>", {"a": True}, name="profiled_style")
+        self.simulate('''<div><if condition="<var>a</var>">!</if><breakpoint name="b">base</breakpoint></div>''',
+                      "<div>!base</div>", {"a": True}, name="profiled_base")
+        self.simulate('''<rebase>subfolder.profiled_base</rebase>
+        <breakpoint name="b">
+            <list for="row" in="rows"><var>row</var></list>
+        </breakpoint>''', "<div>!12</div>", {"a": True, "rows": [1, 2]}, name="profiled_child")
+        with open("views/__py__/subfolder_profiled.py") as f:
+            self.assertNotIn("SuitProfiler.", f.read())
+
+        SuitProfiler.reset()
+        os.chdir("views")
+        try:
+            Compiler(profile=True).compile()
+        finally:
+            os.chdir("../")
+        try:
+            self.assertEqual("23", Suit("views.subfolder.profiled").execute({"rows": [1, 2, 3]}))
+            # теги отмечены строкой и колонкой в исходном тексте шаблона
+            report = {item["tag"]: item for item in SuitProfiler.report(top=None)}
+            self.assertEqual({"list at 1:1", "if at 2:13", "filter int"}, set(report))
+            self.assertEqual((1, 2), (report["list at 1:1"]["calls"], report["list at 1:1"]["bytes"]))
+            self.assertEqual(3, report["if at 2:13"]["calls"])
+            self.assertEqual(2, report["filter int"]["calls"])
+            self.assertEqual("subfolder/profiled.html", report["list at 1:1"]["template"])
+            self.assertEqual(1, len(SuitProfiler.report(top=1)))
+
+            # при потоковом выполнении циклы и условия учитываются так же
+            SuitProfiler.reset()
+            self.assertEqual(b"23", b"".join(Suit("views.subfolder.profiled").render_iter({"rows": [1, 2, 3]})))
+            report = {item["tag"]: item for item in SuitProfiler.report(top=None)}
+            self.assertEqual({"list at 1:1", "if at 2:13", "filter int"}, set(report))
+            self.assertEqual((1, 2), (report["list at 1:1"]["calls"], report["list at 1:1"]["bytes"]))
+            self.assertEqual(3, report["if at 2:13"]["calls"])
+
+            SuitProfiler.reset()
+            Suit("views.subfolder.profiled_style").execute({"a": True})
+            Suit("views.subfolder.profiled_child").execute({"a": True, "rows": [1, 2]})
+            self.assertEqual({
+                ("subfolder/profiled_style.html", "if at 5:13"),
+                ("subfolder/profiled_child.html", "list at 3:13"),
+                ("subfolder/profiled_child.html", "if at subfolder/profiled_base.html:1:6"),
+            }, {(item["template"], item["tag"]) for item in SuitProfiler.report(top=None)})
+        finally:
+            os.chdir("views")
+            Compiler().compile()
+            os.chdir("../")
+
+    def test_breakPoint_include_scope(self):
+        """ Включаемые шаблоны получают данные родителя без копирования и не изменяют их """
+        class NotCopyable(dict):
+            def __deepcopy__(self, memo):
+                raise AssertionError("data should not be copied")
+
+        self.simulate('''<var>a</var>:<var>big.x</var>;''', "0:1;", {"a": 0, "big": {"x": 1}}, name="inc_scope")
+        template = '''<list for="user" in="users"><breakpoint include="subfolder.inc_scope">{"a": "<var>user</var>"}</breakpoint></list>'''
+        self.simulate(template, "u1:1;u2:1;", {"users": ["u1", "u2"], "big": {"x": 1}}, name="scope")
+
+        data = {"users": ["u1", "u2"], "big": NotCopyable(x=1)}
+        self.assertEqual("u1:1;u2:1;", Suit("views.subfolder.scope").execute(data))
+        self.assertEqual({"users": ["u1", "u2"], "big": {"x": 1}}, data)
+
+    def test_breakPoint_include_params_compiled(self):
+        """ Параметры включаемых шаблонов компилируются в словарь, параметры из циклов и условий вычисляются в рантайме """
+        syntax = PythonSyntax()
+        self.assertEqual(
+            '''{"a": SuitRunTime.parameter(_path0(_context, None), 'inc', 'page.html:2:1'), "b": ("x" + str(SuitRunTime.stringify(_path1(_context, None)))), "c": [True, None]}''',
+            syntax.include_params(buildTree('''{"a": <var>a</var>, "b": "x<var>b</var>", "c": [true, null]}'''), "inc", "page.html:2:1")
+        )
+        self.assertEqual(None, syntax.include_params(buildTree('''{"a": <if condition="1"><var>a</var></if>}'''), "inc"))
+        self.assertEqual(None, syntax.include_params(buildTree('''{"a": b}'''), "inc"))
+
+        self.simulate('''<var>a</var>,<var>b</var>''', "1,2", {"a": 1, "b": 2}, name="inc_params")
+        template = '''<breakpoint include="subfolder.inc_params">{"a": <var>a</var>, "b": <if condition="<var>n</var> > 1">"big"</if><if condition="<var>n</var> <= 1">"small"</if>}</breakpoint>'''
+        self.simulate(template, "2,big", {"a": 2, "n": 2}, name="params")
+        self.assertEqual("1,small", Suit("views.subfolder.params").execute({"a": 1, "n": 1}))
+        with self.assertRaisesRegex(TemplateParseError, "subfolder.inc_params at subfolder/params.html:1:1"):
+            Suit("views.subfolder.params").execute({"a": "x", "n": 1})
+
+        # строка, не являющаяся JSON, в скомпилированных параметрах - такая же ошибка, как и при разборе в рантайме
+        self.simulate('''<breakpoint include="subfolder.inc_params">{"a": <var>a</var>, "b": 2}</breakpoint>''', "[1],2", {"a": "[1]"}, name="params_fast")
+        with self.assertRaisesRegex(TemplateParseError, "subfolder.inc_params at subfolder/params_fast.html:1:1: str value"):
+            Suit("views.subfolder.params_fast").execute({"a": "str value"})
+
     # ################################# Регрессионные тесты альфа-тестирования ##################################
 
     def test_regressive_specialChars(self):
@@ -1353,6 +1878,131 @@ class SuitTest(unittest.TestCase):
         executed = Suit("views.subfolder.template").execute(data)
         self.assertEqual(expected, executed)
 
+    def test_compiler_incremental(self):
+        """
+        Повторная компиляция должна пропускать шаблоны, исходники которых
+        (и исходники шаблонов, от которых они зависят) не изменились
+
+        """
+        templates = {
+            "base": '''1<breakpoint name="center">2</breakpoint>3''',
+            "child": '''<rebase>subfolder.base</rebase><breakpoint name="center"><breakpoint include="subfolder.inc"></breakpoint></breakpoint>''',
+            "inc": '''<var>a</var>''',
+            "other": '''other'''
+        }
+        for name, template in templates.items():
+            with open("views/subfolder/%s.html" % name, "w+") as f:
+                f.write(template)
+
+        os.chdir("views")
+        self.c.compile()
+        self.assertEqual((4, 0), (self.c.compiled, self.c.skipped))
+        self.c.compile()
+        self.assertEqual((0, 4), (self.c.compiled, self.c.skipped))
+
+        # Изменение включаемого шаблона должно привести к перекомпиляции шаблона, который его включает
+        with open("subfolder/inc.html", "w+") as f:
+            f.write('''-<var>a</var>-''')
+        self.c.compile()
+        self.assertEqual((2, 2), (self.c.compiled, self.c.skipped))
+
+        # Удаленный результат компиляции должен быть восстановлен
+        os.remove("__py__/subfolder_other.py")
+        self.c.compile()
+        self.assertEqual((1, 3), (self.c.compiled, self.c.skipped))
+        os.chdir("../")
+
+        self.assertEqual("1-2-3", Suit("views.subfolder.child").execute({"a": 2}))
+
+    def test_template_registry(self):
+        """
+        Скомпилированные шаблоны импортируются один раз и хранятся в реестре,
+        перекомпилированные шаблоны удаляются из реестра
+
+        """
+        with open("views/subfolder/registered.html", "w+") as f:
+            f.write("first")
+        os.chdir("views")
+        self.c.compile()
+        os.chdir("../")
+
+        Suit.registry.clear()
+        self.assertEqual("first", Suit("views.subfolder.registered").execute())
+        self.assertEqual("first", Suit("views.subfolder.registered").execute())
+        self.assertEqual((1, 1), (Suit.registry.hits, Suit.registry.misses))
+
+        with open("views/subfolder/registered.html", "w+") as f:
+            f.write("second")
+        os.chdir("views")
+        self.c.compile()
+        os.chdir("../")
+        self.assertNotIn("views.subfolder.registered", Suit.registry)
+        self.assertEqual("second", Suit("views.subfolder.registered").execute())
+
+        Suit.invalidate("views.subfolder.registered")
+        self.assertEqual(0, len(Suit.registry))
+
+    def test_compiler_jobs(self):
+        """ Параллельная компиляция должна давать точно такой же результат, что и последовательная """
+        templates = {
+            "p_base": '''1<breakpoint name="center">2</breakpoint>3<style>p { color: red; }</style>''',
+            "p_child": '''<rebase>subfolder.p_base</rebase><breakpoint name="center"><breakpoint include="subfolder.p_inc"></breakpoint></breakpoint>''',
+            "p_inc": '''<list for="a" in="items"><if condition="<var>a</var> > 1"><var>a</var></if></list>''',
+            "p_other": '''other<script>(function() { return {}; })</script>'''
+        }
+        for name, template in templates.items():
+            with open("views/subfolder/%s.html" % name, "w+") as f:
+                f.write(template)
+
+        def compile_and_read(jobs):
+            os.chdir("views")
+            for directory in ["__py__", "__js__", "__css__"]:
+                if os.path.isdir(directory):
+                    self.clearDir(directory)
+            self.c.compile(jobs=jobs)
+            self.c.build()
+            os.chdir("../")
+            result = {}
+            for directory in ["__py__", "__js__", "__css__"]:
+                for file in os.listdir("views/%s" % directory):
+                    if os.path.isfile("views/%s/%s" % (directory, file)) and file != "manifest.json":
+                        with open("views/%s/%s" % (directory, file), "rb") as f:
+                            result[directory + file] = f.read()
+            return result
+
+        serial = compile_and_read(1)
+        parallel = compile_and_read(4)
+        self.assertEqual(4, self.c.compiled)
+        self.assertEqual(serial, parallel)
+        self.assertEqual("1233", Suit("views.subfolder.p_child").execute({"items": [1, 2, 3]}))
+
+    def test_template_loader(self):
+        """ Загрузчик шаблонов не должен менять текущий каталог и должен замечать изменения шаблонов """
+        with open("views/subfolder/loaded.html", "w+") as f:
+            f.write("first")
+        cwd = os.getcwd()
+
+        loader = TemplateLoader(["views"])
+        self.assertEqual("first", loader.load("subfolder/loaded.html")[1])
+
+        # Поиск шаблона по абсолютному имени поднимается по дереву каталогов, но не меняет текущий каталог
+        path = TemplateLoader(["views/subfolder"]).find("views/subfolder/loaded.html")
+        self.assertEqual(os.path.realpath("views/subfolder/loaded.html"), path)
+        self.assertEqual(cwd, os.getcwd())
+        self.assertRaises(TemplateNotFound, loader.find, "subfolder/missing.html")
+
+        # Изменение шаблона инвалидирует индекс
+        with open("views/subfolder/loaded.html", "w+") as f:
+            f.write("second")
+        stat = os.stat("views/subfolder/loaded.html")
+        os.utime("views/subfolder/loaded.html", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual("second", loader.load("subfolder/loaded.html")[1])
+
+        # Загрузчик может использоваться из нескольких потоков одновременно
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            contents = list(executor.map(lambda i: loader.load("subfolder/loaded.html")[1], range(100)))
+        self.assertEqual(["second"] * 100, contents)
+
     def test_build_js(self):
         """
         Компилятор должен уметь собирать все скомпилированные js-шаблоны в единый js-файл,